@@ -5,7 +5,14 @@ def create_app():
     app = Flask(__name__)
 
     # Import and register blueprints/routes
-    from .routes import main
+    from .routes import main, registry
     app.register_blueprint(main)
 
+    # flask --app run export <dir>: pre-render the menu routes to static files
+    from .export import export_command
+    app.cli.add_command(export_command)
+
+    # Warm start from the on-disk cache snapshots, if configured
+    registry.load_snapshots()
+
     return app
@@ -0,0 +1,160 @@
+import datetime
+import gzip
+import json
+import os
+import time
+from typing import Any, Dict, List
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+
+try:
+    import brotli
+except ImportError:  # optional; exports then only get .gz siblings
+    brotli = None
+
+# format prefix in the route -> file extension
+formats = {'': 'txt', 'json/': 'json', 'html/': 'html'}
+languages = ('sv', 'en', 'fi')
+
+
+def export_routes(client, days: int) -> List[tuple]:
+    ''' Returns (url, dates) of every exported route of the client's site: today, week and
+        0..days in every language and format, with the dates each response is built from '''
+    today = datetime.date.today().isoformat()
+    site = client.site_id
+    routes = []
+    for language in languages:
+        for prefix in formats:
+            routes.append((f"/{site}/{language}/{prefix}today/", [today]))
+            routes.append((f"/{site}/{language}/{prefix}week/", client.next_meal_dates(5)))
+            for day in range(0, days + 1):
+                routes.append((f"/{site}/{language}/{prefix}{day}/", [client.next_meal_date(day)]))
+    return routes
+
+
+def output_path(url: str) -> str:
+    ''' /taffa/sv/json/week/ -> taffa/sv/json/week/index.json '''
+    parts = url.strip("/").split("/")
+    prefix = f"{parts[2]}/" if len(parts) > 3 else ""
+    return "/".join(parts) + f"/index.{formats[prefix]}"
+
+
+def _write(path: str, data: bytes):
+    # atomic replace, so a file server never sees a half-written file
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def export_static(app, clients, out_dir: str, days: int = 5, force: bool = False) -> Dict[str, int]:
+    """ Pre-renders the menu routes into static files under out_dir, each with a .gz (and,
+        when brotli is installed, .br) sibling, and records them in out_dir/manifest.json.
+        Only outputs whose source days changed since the last export are rendered again;
+        outputs depending on a day upstream could not deliver keep their previous file.
+    Parameters
+    app     - the Flask app the responses are rendered with
+    clients - the APIClients of the sites to export
+    out_dir - directory the files are written to
+    days    - export /<site>/<language>/0/ to /<site>/<language>/<days>/
+    force   - render every output even if unchanged
+    Returns
+    {"written": n, "unchanged": n, "failed": n}
+    """
+    manifest_path = os.path.join(out_dir, "manifest.json")
+    try:
+        with open(manifest_path, encoding="utf-8") as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        manifest = {}
+    previous: Dict[str, Any] = manifest.get("files", {})
+
+    routes, digests = [], {}
+    for client in clients:
+        site_routes = export_routes(client, days)
+        # one batched fetch of every day, then the payload digest of each day versions its outputs
+        dates = sorted({date for _, route_dates in site_routes for date in route_dates})
+        client.fetch_raw_menus(dates, deadline=time.time() + client.request_deadline)
+        digests[client.site_id] = dict(zip(dates, client.menu_digests(dates)))
+        routes.extend((client.site_id, url, route_dates) for url, route_dates in site_routes)
+
+    files: Dict[str, Any] = {}
+    counts = {"written": 0, "unchanged": 0, "failed": 0}
+    http = app.test_client()
+    for site, url, route_dates in routes:
+        path = output_path(url)
+        versions = [digests[site][date] for date in route_dates]
+        old = previous.get(url)
+        if None in versions:
+            # upstream failed for a source day; keep serving the previous export
+            if old is not None:
+                files[url] = old
+            counts["failed"] += 1
+            continue
+        if not force and old is not None and old["dates"] == route_dates and old["versions"] == versions \
+                and os.path.exists(os.path.join(out_dir, path)):
+            files[url] = old
+            counts["unchanged"] += 1
+            continue
+
+        response = http.get(url)
+        if response.status_code != 200:
+            if old is not None:
+                files[url] = old
+            counts["failed"] += 1
+            continue
+        body = response.get_data()
+        _write(os.path.join(out_dir, path), body)
+        entry = {
+            "path": path,
+            "dates": route_dates,
+            "versions": versions,
+            "etag": response.get_etag()[0],
+            "content_type": response.content_type,
+            "size": len(body),
+            "rendered_at": time.time(),
+        }
+        # mtime=0 keeps the compressed files identical for identical bodies
+        compressed = gzip.compress(body, compresslevel=9, mtime=0)
+        _write(os.path.join(out_dir, path + ".gz"), compressed)
+        entry["gzip_size"] = len(compressed)
+        if brotli is not None:
+            compressed = brotli.compress(body, quality=11)
+            _write(os.path.join(out_dir, path + ".br"), compressed)
+            entry["brotli_size"] = len(compressed)
+        files[url] = entry
+        counts["written"] += 1
+
+    # sites left out of this run keep their entries
+    exported = {client.site_id for client in clients}
+    for url, entry in previous.items():
+        if url.split("/")[1] not in exported:
+            files.setdefault(url, entry)
+
+    manifest = {"generated_at": time.time(), "files": files}
+    _write(manifest_path, json.dumps(manifest, ensure_ascii=False, indent=1).encode("utf-8"))
+    return counts
+
+
+@click.command("export")
+@click.argument("out_dir")
+@click.option("--days", default=5, show_default=True, help="Export the 0 to DAYS day routes")
+@click.option("--force", is_flag=True, help="Render every output, even if its days did not change")
+@click.option("--site", "sites", multiple=True, help="Only export this site (repeatable), default all")
+@with_appcontext
+def export_command(out_dir, days, force, sites):
+    ''' Pre-renders the menu routes into static files in OUT_DIR '''
+    from .routes import registry
+    clients = list(registry)
+    if sites:
+        unknown = [site for site in sites if registry.get(site) is None]
+        if unknown:
+            raise click.BadParameter(f"unknown site {', '.join(unknown)}", param_hint="--site")
+        clients = [registry.get(site) for site in sites]
+    counts = export_static(current_app, clients, out_dir, days=days, force=force)
+    click.echo(f"{counts['written']} written, {counts['unchanged']} unchanged, {counts['failed']} failed")
+    if counts["failed"]:
+        raise SystemExit(1)
@@ -0,0 +1,291 @@
+import bisect
+import glob
+import json
+import os
+import threading
+import time
+from typing import Any, Dict, List, Tuple
+
+
+# Latency buckets in seconds, from sub-millisecond parsing up to slow upstream calls
+DEFAULT_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+                   0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names: Tuple[str, ...], values: Tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+# Monotonic counter, optionally labelled. Thread-safe; one lock per metric keeps
+# updates cheap and uncontended between different metrics.
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values: Dict[Tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, n: float = 1, **labels):
+        key = tuple(labels.get(name, "") for name in self.labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + n
+
+    def state(self) -> list:
+        with self._lock:
+            return [[list(key), value] for key, value in self._values.items()]
+
+    @staticmethod
+    def merge(states: List[list]) -> Dict[Tuple, float]:
+        merged: Dict[Tuple, float] = {}
+        for state in states:
+            for key, value in state:
+                merged[tuple(key)] = merged.get(tuple(key), 0) + value
+        return merged
+
+    def samples(self, values: Dict[Tuple, float] = None) -> List[str]:
+        if values is None:
+            values = self.merge([self.state()])
+        return [f"{self.name}{_format_labels(self.labels, key)} {_format_value(value)}" for key, value in sorted(values.items())]
+
+
+# Cumulative histogram in the Prometheus sense: per label set, a count per bucket upper
+# bound plus the running sum and count of observations.
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = (), buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+        # label values -> [per-bucket counts (last one is +Inf), sum, count]
+        self._values: Dict[Tuple, list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = tuple(labels.get(name, "") for name in self.labels)
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            entry[0][i] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def state(self) -> list:
+        with self._lock:
+            return [[list(key), list(entry[0]), entry[1], entry[2]] for key, entry in self._values.items()]
+
+    @staticmethod
+    def merge(states: List[list]) -> Dict[Tuple, tuple]:
+        merged: Dict[Tuple, tuple] = {}
+        for state in states:
+            for key, counts, total, count in state:
+                previous = merged.get(tuple(key))
+                if previous is not None:
+                    counts = [a + b for a, b in zip(previous[0], counts)]
+                    total, count = previous[1] + total, previous[2] + count
+                merged[tuple(key)] = (counts, total, count)
+        return merged
+
+    def samples(self, values: Dict[Tuple, tuple] = None) -> List[str]:
+        if values is None:
+            values = self.merge([self.state()])
+        lines = []
+        for key, (counts, total, count) in sorted(values.items()):
+            cumulative = 0
+            for bound, n in zip(self.buckets + (float('inf'),), counts):
+                cumulative += n
+                le = 'le="' + _format_value(bound) + '"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labels, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labels, key)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(self.labels, key)} {count}")
+        return lines
+
+
+# Value read when the registry is rendered, for state that already lives elsewhere
+# (cache sizes, limiter rate). func returns a number or a dict of label value -> number.
+class Gauge:
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str, func, label: str = None):
+        self.name = name
+        self.help = help
+        self.func = func
+        self.label = label
+
+    def state(self):
+        return self.func()
+
+    def samples(self, values: Dict[str, Any] = None) -> List[str]:
+        ''' values: {worker: value} of several processes, each sample then gets a worker label '''
+        if values is None:
+            values = {None: self.func()}
+        lines = []
+        for worker, value in sorted(values.items(), key=lambda item: str(item[0])):
+            extra = "" if worker is None else f'worker="{_escape(worker)}"'
+            if isinstance(value, dict):
+                lines.extend(f"{self.name}{_format_labels((self.label,), (key,), extra)} {_format_value(v)}"
+                             for key, v in sorted(value.items()))
+            else:
+                lines.append(f"{self.name}{_format_labels((), (), extra)} {_format_value(value)}")
+        return lines
+
+
+def _write_json(path: str, data):
+    # atomic replace, so readers never see a half-written file
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
+
+
+def _read_json(path: str):
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def mark_process_dead(directory: str, pid: int):
+    ''' Folds the counters and histograms of an exited worker into the directory's archive,
+        so the totals do not drop, and removes its file (and with it its gauges). To be called
+        by a single process, e.g. the gunicorn master. '''
+    path = os.path.join(directory, f"{pid}.json")
+    state = _read_json(path)
+    if state is not None:
+        archive_path = os.path.join(directory, "archive.json")
+        archive = _read_json(archive_path) or {}
+        for name, metric in state.get("metrics", {}).items():
+            if metric["kind"] == "gauge":
+                continue
+            previous = archive.get(name)
+            merge = Counter.merge if metric["kind"] == "counter" else Histogram.merge
+            merged = merge([metric["state"]] + ([previous["state"]] if previous else []))
+            if metric["kind"] == "counter":
+                merged_state = [[list(key), value] for key, value in merged.items()]
+            else:
+                merged_state = [[list(key), counts, total, count] for key, (counts, total, count) in merged.items()]
+            archive[name] = {"kind": metric["kind"], "state": merged_state}
+        _write_json(archive_path, archive)
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+# Metrics registry rendered in the Prometheus text exposition format. Per process, unless
+# directory is given: every process sharing it then writes its values to <directory>/<pid>.json
+# (flush(), called periodically and on every render) and render() reports the sum of all
+# processes' counters and histograms, plus every live process's gauges labelled by worker.
+class Metrics:
+    def __init__(self, directory: str = None):
+        self._metrics = []
+        self._lock = threading.Lock()
+        self.directory = directory or None
+
+    def _register(self, metric):
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, help: str, labels: Tuple[str, ...] = ()) -> Counter:
+        return self._register(Counter(name, help, labels))
+
+    def histogram(self, name: str, help: str, labels: Tuple[str, ...] = (), buckets: Tuple[float, ...] = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, help, labels, buckets))
+
+    def gauge(self, name: str, help: str, func, label: str = None) -> Gauge:
+        return self._register(Gauge(name, help, func, label))
+
+    def flush(self):
+        ''' Writes this process's values to the shared directory (no-op without one) '''
+        if self.directory is None:
+            return
+        with self._lock:
+            metrics = list(self._metrics)
+        state = {}
+        for metric in metrics:
+            try:
+                state[metric.name] = {"kind": metric.kind, "state": metric.state()}
+            except Exception:
+                continue
+        _write_json(os.path.join(self.directory, f"{os.getpid()}.json"), {"written_at": time.time(), "metrics": state})
+
+    def _collect(self) -> Dict[str, Any]:
+        ''' Returns {metric name: merged values} over every process sharing the directory '''
+        self.flush()
+        states: Dict[str, list] = {}
+        gauges: Dict[str, Dict[str, Any]] = {}
+        for path in glob.glob(os.path.join(self.directory, "*.json")):
+            data = _read_json(path)
+            if data is None:
+                continue
+            worker = os.path.basename(path)[:-len(".json")]
+            # the archive holds the counters of exited workers; it has no gauges
+            metrics = data if worker == "archive" else data.get("metrics", {})
+            for name, metric in metrics.items():
+                if metric["kind"] == "gauge":
+                    gauges.setdefault(name, {})[worker] = metric["state"]
+                else:
+                    states.setdefault(name, []).append(metric["state"])
+        merged: Dict[str, Any] = dict(gauges)
+        with self._lock:
+            metrics = list(self._metrics)
+        for metric in metrics:
+            if metric.kind != "gauge":
+                merged[metric.name] = metric.merge(states.get(metric.name, []))
+        return merged
+
+    def start_flusher(self, interval: float, stop_event: threading.Event):
+        ''' Flushes every interval seconds until stop_event is set (no-op without a directory) '''
+        if self.directory is None or interval <= 0:
+            return None
+
+        def loop():
+            while not stop_event.wait(interval):
+                try:
+                    self.flush()
+                except Exception:
+                    pass
+
+        thread = threading.Thread(target=loop, name='metrics-flush', daemon=True)
+        thread.start()
+        return thread
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics)
+        merged = self._collect() if self.directory is not None else {}
+        lines = []
+        for metric in metrics:
+            try:
+                if self.directory is not None:
+                    samples = metric.samples(merged.get(metric.name, {}))
+                else:
+                    samples = metric.samples()
+            except Exception:
+                # a broken gauge must not take the whole endpoint down
+                continue
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(samples)
+        return "\n".join(lines) + "\n"
@@ -1,100 +1,268 @@
-from flask import Blueprint, render_template, Response
-from .utils import APIClient
+from flask import Blueprint, render_template, Response, request, abort, g
+from .sites import ClientRegistry
 import datetime
 import json
-import os
+import time
 
-client = APIClient()
+registry = ClientRegistry()
+# the primary client: shared rate limiter, metrics and tracer, and the default site
+client = registry.primary
 
 # Create a blueprint
 main = Blueprint('main', __name__)
 
+content_types = {
+    'json': 'application/json; charset:utf-8',
+    'text': 'text/plain; charset=utf-8',
+    'html': 'text/html; charset=utf-8',
+}
+
+# Every menu route starts with the id of a configured site; views get its client as g.client
+@main.url_value_preprocessor
+def pull_site(endpoint, values):
+    if values and 'site' in values:
+        g.client = registry.get(values.pop('site'))
+        if g.client is None:
+            abort(404)
+
+# Request timing by route and format for /taffa/metrics, and the request's trace when
+# REQUEST_TRACING is on
+@main.before_app_request
+def start_timer():
+    g.request_start = time.perf_counter()
+    if client.tracer.enabled:
+        # reuse the id of a proxy or client in front of us, if any
+        client.tracer.start(request.headers.get('X-Request-ID', '')[:64] or None)
+
+@main.after_app_request
+def record_request(response):
+    start = g.get('request_start')
+    if start is not None:
+        route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+        client.m_requests.observe(time.perf_counter() - start, route=route, format=g.get('response_format', 'other'))
+    if client.tracer.enabled:
+        trace = client.tracer.finish(method=request.method, path=request.full_path.rstrip('?'), status=response.status_code)
+        if trace is not None:
+            response.headers['X-Request-ID'] = trace.request_id
+            response.headers['Server-Timing'] = trace.server_timing()
+    return response
+
+
 @main.route('/')
 def home():
     return render_template('index.html')
 
+def body_response(fmt, entry):
+    ''' Returns a cacheable response for an entry from client.cached_body, answering
+        with 304 if the client already has it '''
+    response = Response(entry["body"], content_type=content_types[fmt])
+    response.set_etag(entry["etag"])
+    response.last_modified = entry["last_modified"]
+    response.cache_control.public = True
+    response.cache_control.max_age = g.client.response_max_age
+    return response.make_conditional(request)
+
+def render_cached(fmt, key, dates, versions, build):
+    ''' client.cached_body with the time spent rendering recorded per route and format '''
+    g.response_format = fmt
+    route = request.url_rule.rule
+
+    def timed_build():
+        start = time.perf_counter()
+        with client.tracer.span("render"):
+            body = build()
+        client.m_render.observe(time.perf_counter() - start, route=route, format=fmt)
+        return body
+
+    with client.tracer.span("body"):
+        return g.client.cached_body(key, dates, versions, timed_build)
+
+def menu_response(fmt, language, dates, many=False):
+    ''' Builds a cached, conditional response with the menus for dates.
+    fmt: str   - json, text or html
+    many: bool - whether the response lists several days (json array) or one day
+    '''
+    site_client = g.client
+    language = site_client.normalize_language(language)
+    # upstream retries stop when the request's time budget runs out; stale or empty
+    # menus are served instead
+    deadline = time.time() + site_client.request_deadline
+    fetched, versions = site_client.fetch_menus_multi(dates=dates, languages=[language], deadline=deadline)
+    menus = fetched[language]
+
+    def build():
+        if fmt == 'json':
+            return json.dumps(menus if many else menus[0], ensure_ascii=False)
+        if fmt == 'html':
+            return render_template('menu.html', days=menus)
+        return "\n".join(site_client.menu_text(menu) for menu in menus)
+
+    entry = render_cached(fmt, f"{fmt}:{language}:{int(many)}", dates, versions, build)
+    return body_response(fmt, entry)
+
+
 # Todays menu in text format
-@main.route('/taffa/<language>/today/')
+@main.route('/<site>/<language>/today/')
 def todaysMenuText(language):
     todaysDate = datetime.date.today().isoformat()
-    return client.textAndMeals(language=language, date=todaysDate)
+    return menu_response('text', language, [todaysDate])
 
 # Menu in x days in text format
-@main.route('/taffa/<language>/<int:days>/')
+@main.route('/<site>/<language>/<int:days>/')
 def menuText(language, days):
-    date = client.next_meal_date(days)
-    return client.textAndMeals(language=language, date=date)
+    date = g.client.next_meal_date(days)
+    return menu_response('text', language, [date])
 
 # Weekly menu in text format
-@main.route('/taffa/<language>/week/')
+@main.route('/<site>/<language>/week/')
 def weeklyMenuText(language):
-    days = []
-    for i in range(0, 5):
-        date = client.next_meal_date(i)
-        days.append(client.textAndMeals(language=language, date=date))
-    return "\n".join(days)
+    dates = g.client.next_meal_dates(5)
+    return menu_response('text', language, dates, many=True)
 
 
 # Todays menu in json format
-@main.route('/taffa/<language>/json/today/')
+@main.route('/<site>/<language>/json/today/')
 def jsonTodaysMenu(language):
     todaysDate = datetime.date.today().isoformat()
-    menu = client.json_menu(language=language, date=todaysDate)
-    return Response(json.dumps(menu, ensure_ascii=False), mimetype='application/json; charset:utf-8')
+    return menu_response('json', language, [todaysDate])
 
 # Menu in x days in json format
-@main.route('/taffa/<language>/json/<int:days>/') #Needed for info
+@main.route('/<site>/<language>/json/<int:days>/') #Needed for info
 def jsonNextMeal(language, days):
-  date = client.next_meal_date(days)
-  menu = client.json_menu(language=language, date=date)
-  return Response(json.dumps(menu, ensure_ascii=False), mimetype='application/json; charset:utf-8')
+  date = g.client.next_meal_date(days)
+  return menu_response('json', language, [date])
 
 
 # Weekly menu in json format 
-@main.route('/taffa/<language>/json/week/')
+@main.route('/<site>/<language>/json/week/')
 def jsonThisWeek(language):
-    days = []
-    for i in range(0, 5):
-        date = client.next_meal_date(i)
-        days.append(client.json_menu(language=language, date=date))
-    return Response(json.dumps(days, ensure_ascii=False), mimetype='application/json; charset:utf-8')
+    dates = g.client.next_meal_dates(5)
+    return menu_response('json', language, dates, many=True)
 
 
 # Todays menu in html format
-@main.route('/taffa/<language>/html/today/')
+@main.route('/<site>/<language>/html/today/')
 def todaysMenuHTML(language):
-    days = []
     todaysDate = datetime.date.today().isoformat()
-    days.append(client.json_menu(date=todaysDate, language=language))
-    return render_template('menu.html', days=days)
+    return menu_response('html', language, [todaysDate])
 
 # Menu in x days in html format
-@main.route('/taffa/<language>/html/<int:days>/')
+@main.route('/<site>/<language>/html/<int:days>/')
 def menuHTML(language, days):
-    date = client.next_meal_date(days)
-    return render_template('menu.html', days=[client.json_menu(language=language, date=date)])
+    date = g.client.next_meal_date(days)
+    return menu_response('html', language, [date])
 
 # Weekly menu in html format
-@main.route('/taffa/<language>/html/week/')
+@main.route('/<site>/<language>/html/week/')
 def htmlThisWeek(language):
-    days = []
-    for i in range(0, 5):
-        date = client.next_meal_date(i)
-        days.append(client.json_menu(language=language, date=date))
-    return render_template('menu.html', days=days)
+    dates = g.client.next_meal_dates(5)
+    return menu_response('html', language, dates, many=True)
+
+
+def explicit_date(day, month, year):
+    ''' Returns the date as YYYY-MM-DD, or aborts with 404 for dates that do not exist '''
+    try:
+        return datetime.date(year, month, day).isoformat()
+    except ValueError:
+        abort(404)
 
 
-@main.route('/taffa/<language>/<day>/<month>/<year>/') #FIXME: Are these needed?
+# Menu on a given date in text format
+@main.route('/<site>/<language>/<int:day>/<int:month>/<int:year>/')
+@main.route('/<site>/<language>/txt/<int:day>/<int:month>/<int:year>/')
+def dateMenuText(language, day, month, year):
+    return menu_response('text', language, [explicit_date(day, month, year)])
 
-@main.route('/taffa/<language>/txt/<day>/<month>/<year>/') #FIXME: Are these needed?
+# Menu on a given date in json format
+@main.route('/<site>/<language>/json/<int:day>/<int:month>/<int:year>/')
+def dateMenuJSON(language, day, month, year):
+    return menu_response('json', language, [explicit_date(day, month, year)])
 
-@main.route('/taffa/<language>/json/<day>/<month>/<year>/') #FIXME: Are these needed?
+# Menu on a given date in html format
+@main.route('/<site>/<language>/html/<int:day>/<int:month>/<int:year>/')
+def dateMenuHTML(language, day, month, year):
+    return menu_response('html', language, [explicit_date(day, month, year)])
 
-@main.route('/taffa/<language>/html/<day>/<month>/<year>/') #FIXME: Are these needed?
 
+def range_dates():
+    ''' Returns the serving days between the from and to query parameters (YYYY-MM-DD,
+        both inclusive), or aborts with 400 if they are missing, invalid or too far apart '''
+    try:
+        start = datetime.date.fromisoformat(request.args['from'])
+        end = datetime.date.fromisoformat(request.args['to'])
+    except (KeyError, ValueError):
+        abort(400, description="from and to must be dates in format YYYY-MM-DD")
+    if end < start or (end - start).days + 1 > g.client.range_max_days:
+        abort(400, description=f"to must be on or after from and at most {g.client.range_max_days} days later")
+    return g.client.serving_dates(start.isoformat(), end.isoformat())
+
+
+# Menus for a range of dates in text format
+@main.route('/<site>/<language>/range/')
+def rangeMenuText(language):
+    return menu_response('text', language, range_dates(), many=True)
+
+# Menus for a range of dates in json format
+@main.route('/<site>/<language>/json/range/')
+def rangeMenuJSON(language):
+    return menu_response('json', language, range_dates(), many=True)
+
+# Menus for a range of dates in html format
+@main.route('/<site>/<language>/html/range/')
+def rangeMenuHTML(language):
+    return menu_response('html', language, range_dates(), many=True)
+
+
+def bulk_dates():
+    ''' Returns the dates of a bulk request: the from/to range if given, otherwise the
+        next days (default 5) serving days '''
+    if 'from' in request.args or 'to' in request.args:
+        return range_dates()
+    try:
+        count = int(request.args.get('days', 5))
+    except ValueError:
+        abort(400, description="days must be a number")
+    if count < 1 or count > g.client.range_max_days:
+        abort(400, description=f"days must be between 1 and {g.client.range_max_days}")
+    return g.client.next_meal_dates(count)
+
+
+# Menus in several languages in one response, built from one cache lookup per date
+# ?languages=sv,fi,en  &days=5 or &from=YYYY-MM-DD&to=YYYY-MM-DD  &format=json|text|html
+@main.route('/<site>/bulk/')
+def bulkMenus():
+    site_client = g.client
+    fmt = request.args.get('format', 'json')
+    if fmt not in content_types:
+        abort(400, description="format must be json, text or html")
+    requested = [language for language in request.args.get('languages', 'sv,fi,en').split(',') if language.strip()]
+    if not requested:
+        abort(400, description="languages must list at least one language")
+    languages = list(dict.fromkeys(site_client.normalize_language(language.strip()) for language in requested))
+    dates = bulk_dates()
+
+    deadline = time.time() + site_client.request_deadline
+    menus, versions = site_client.fetch_menus_multi(dates=dates, languages=languages, deadline=deadline)
+
+    def build():
+        if fmt == 'json':
+            return json.dumps(menus, ensure_ascii=False)
+        if fmt == 'html':
+            return render_template('bulk.html', languages=menus)
+        return "\n".join(
+            f"[{language}]\n" + "\n".join(site_client.menu_text(menu) for menu in days)
+            for language, days in menus.items()
+        )
+
+    entry = render_cached(fmt, f"bulk:{fmt}:{','.join(languages)}", dates, versions, build)
+    return body_response(fmt, entry)
 
 
 # Explicit error handlers
+@main.errorhandler(400)
+def bad_request(e):
+    return render_template('400.html', description=e.description), 400
+
 @main.errorhandler(404)
 def not_found(e):
     return render_template('404.html'), 404
@@ -104,12 +272,18 @@ def internal_error(e):
     return render_template('500.html'), 500
 
 
-# Simple metrics endpoint for debugging per-process counters
-if os.getenv('API_DEBUG', '0').lower() in ('1', 'true', 'yes'):
-    @main.route('/taffa/metrics')
-    def metrics():
-        try:
-            metrics = client._metrics
-            return Response(json.dumps(metrics), mimetype='application/json; charset:utf-8')
-        except Exception:
-            return Response(json.dumps({}), mimetype='application/json; charset:utf-8')
\ No newline at end of file
+# Counters and latency histograms of all worker processes (all sites) in Prometheus text format
+@main.route('/taffa/metrics')
+def metrics():
+    return Response(client.metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+# Cache statistics (always available)
+@main.route('/<site>/cache')
+def cache_stats():
+    return Response(json.dumps(g.client.cache_stats()), mimetype='application/json; charset:utf-8')
+
+# Cache and rate limiter statistics (always available)
+@main.route('/<site>/stats')
+def stats():
+    return Response(json.dumps(g.client.stats()), mimetype='application/json; charset:utf-8')
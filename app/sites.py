@@ -0,0 +1,70 @@
+import json
+import os
+from typing import Any, Dict, List
+
+from dotenv import load_dotenv
+
+from .utils import APIClient
+
+
+# The sites (Poweresta site and menu, each under its own route prefix) served by the app.
+# Every site gets its own APIClient with its own token, caches and prefetch schedule; all of
+# them share the first site's upstream connection pool, rate budget and circuit breaker.
+class ClientRegistry:
+    def __init__(self, sites: List[Dict[str, Any]] = None):
+        """
+        Parameters
+        sites - site settings: {"id": route prefix, "site_name", "menu_name", "tenant",
+                "api_username", "api_password", "prefetch_days"}; omitted settings are read
+                from the environment. Default: SITES_CONFIG, a JSON list of such objects or
+                a file holding one, otherwise a single site from the environment served
+                under DEFAULT_SITE (taffa).
+        """
+        if sites is None:
+            sites = self._configured_sites()
+        if not sites:
+            raise ValueError("At least one site must be configured")
+        self.clients: Dict[str, APIClient] = {}
+        for site in sites:
+            site = dict(site)
+            site["id"] = str(site.get("id") or site.get("site_name") or "").strip("/")
+            if not site["id"] or site["id"] in self.clients:
+                raise ValueError(f"Sites need unique ids, got {site['id']!r}")
+            primary = next(iter(self.clients.values()), None)
+            self.clients[site["id"]] = APIClient(site=site, shared=primary)
+
+    @staticmethod
+    def _configured_sites() -> List[Dict[str, Any]]:
+        load_dotenv(override=True)
+        config = os.getenv("SITES_CONFIG", "").strip()
+        if not config:
+            return [{"id": os.getenv("DEFAULT_SITE", "taffa")}]
+        if not config.startswith("["):
+            with open(config, encoding="utf-8") as f:
+                config = f.read()
+        return json.loads(config)
+
+    @property
+    def primary(self) -> APIClient:
+        ''' The first site's client, which owns the shared upstream resources '''
+        return next(iter(self.clients.values()))
+
+    def get(self, site_id: str) -> APIClient:
+        ''' Returns the client of site_id, or None if there is no such site '''
+        return self.clients.get(site_id)
+
+    def __iter__(self):
+        return iter(self.clients.values())
+
+    def load_snapshots(self) -> int:
+        return sum(client.load_snapshot() for client in self)
+
+    def after_fork(self):
+        ''' APIClient.after_fork for every client, the primary first as the others share its resources '''
+        for client in self:
+            client.after_fork()
+
+    def close(self):
+        # the primary last, it owns the session and pools the others use
+        for client in reversed(list(self)):
+            client.close()
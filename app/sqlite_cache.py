@@ -0,0 +1,217 @@
+import json
+import os
+import sqlite3
+import stat
+import tempfile
+import threading
+import time
+import uuid
+from typing import Any, Dict
+
+
+# None on Windows, where the temporary directory is already per user
+_uid = os.getuid() if hasattr(os, 'getuid') else None
+
+
+def default_path() -> str:
+    ''' <tmp>/dagsenapi-<uid>/cache.sqlite3, in a directory only the current user can access '''
+    directory = os.path.join(tempfile.gettempdir(), f"dagsenapi-{_uid}" if _uid is not None else "dagsenapi")
+    try:
+        os.mkdir(directory, 0o700)
+    except FileExistsError:
+        pass
+    # the name is predictable, so it may have been created by someone else
+    info = os.lstat(directory)
+    if _uid is not None and (not stat.S_ISDIR(info.st_mode) or info.st_uid != _uid or info.st_mode & 0o077):
+        raise PermissionError(f"{directory} is not a private directory of the current user")
+    return os.path.join(directory, "cache.sqlite3")
+
+
+# Host-wide cache shared by every worker process through a local SQLite file in WAL mode.
+# Same interface as utils.TTLCache, plus a cross-process lock so only one process per host
+# fetches a key from upstream. Values must be json serializable.
+# The file is only readable by its owner, as it also holds secrets (the API token) in a
+# table of their own that the entry budget does not apply to.
+class SQLiteCache:
+    def __init__(self, path: str, max_entries: int = 1024):
+        self.path = path
+        self.max_entries = int(max_entries)
+        # unique per process and thread, used as the lock owner
+        self._owner_prefix = uuid.uuid4().hex
+        self._local = threading.local()
+        self.lock = threading.Lock()
+        self._stats = {'hits': 0, 'stale_hits': 0, 'misses': 0, 'evictions': 0, 'expirations': 0}
+        self._create_private(path)
+        conn = self._conn()
+        conn.execute("CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, fresh_until REAL, expires_at REAL, value TEXT, version TEXT)")
+        if "version" not in [row[1] for row in conn.execute("PRAGMA table_info(cache)")]:
+            # a file from before versions: its entries are refetched rather than migrated
+            try:
+                conn.execute("BEGIN IMMEDIATE")
+                conn.execute("DELETE FROM cache")
+                conn.execute("ALTER TABLE cache ADD COLUMN version TEXT")
+                conn.execute("COMMIT")
+            except sqlite3.OperationalError:
+                # another worker migrated it first
+                try:
+                    conn.execute("ROLLBACK")
+                except sqlite3.Error:
+                    pass
+        conn.execute("CREATE TABLE IF NOT EXISTS locks (key TEXT PRIMARY KEY, owner TEXT, expires_at REAL)")
+        conn.execute("CREATE TABLE IF NOT EXISTS secrets (key TEXT PRIMARY KEY, expires_at REAL, value TEXT)")
+
+    @staticmethod
+    def _create_private(path: str):
+        # Creates the file with mode 0600 before SQLite does (its -wal and -shm files get the
+        # same mode); an existing file must belong to the current user
+        fd = os.open(path, os.O_RDWR | os.O_CREAT | getattr(os, 'O_NOFOLLOW', 0), 0o600)
+        try:
+            info = os.fstat(fd)
+            if _uid is not None and info.st_uid != _uid:
+                raise PermissionError(f"{path} belongs to another user")
+            if _uid is not None and info.st_mode & 0o077:
+                os.fchmod(fd, 0o600)
+        finally:
+            os.close(fd)
+
+    def _conn(self) -> sqlite3.Connection:
+        # One connection per thread; connections must not be shared across a fork
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _count(self, stat: str, n: int = 1):
+        with self.lock:
+            self._stats[stat] += n
+
+    def get(self, key: str):
+        ''' Returns the value for key if it is fresh, otherwise None '''
+        entry = self.get_entry(key)
+        if entry is None or time.time() > entry[1]:
+            return None
+        return entry[0]
+
+    def get_entry(self, key: str):
+        ''' Returns (value, fresh_until) for key, including stale entries, or None '''
+        row = self._conn().execute("SELECT fresh_until, expires_at, value FROM cache WHERE key = ?", (key,)).fetchone()
+        now = time.time()
+        if row is None or now > row[1]:
+            self._count('misses')
+            return None
+        self._count('hits' if now <= row[0] else 'stale_hits')
+        return json.loads(row[2]), row[0]
+
+    def peek(self, key: str):
+        ''' Returns the value for key, including stale entries, without touching stats '''
+        row = self._conn().execute("SELECT expires_at, value FROM cache WHERE key = ?", (key,)).fetchone()
+        if row is None or time.time() > row[0]:
+            return None
+        return json.loads(row[1])
+
+    def peek_version(self, key: str):
+        ''' Returns the version stored with the value for key, including stale entries, or None;
+            only the version column is read, so it is much cheaper than peek '''
+        row = self._conn().execute("SELECT expires_at, version FROM cache WHERE key = ?", (key,)).fetchone()
+        if row is None or row[1] is None or time.time() > row[0]:
+            return None
+        return json.loads(row[1])
+
+    def set(self, key: str, value: Any, ttl: int = 60, stale_ttl: int = 0, version: Any = None):
+        fresh_until = time.time() + int(ttl)
+        conn = self._conn()
+        conn.execute(
+            "INSERT OR REPLACE INTO cache (key, fresh_until, expires_at, value, version) VALUES (?, ?, ?, ?, ?)",
+            (key, fresh_until, fresh_until + max(0, int(stale_ttl)), json.dumps(value, ensure_ascii=False),
+             json.dumps(version) if version is not None else None),
+        )
+        # Keep within the entry budget by dropping the entries closest to expiry
+        overflow = conn.execute("SELECT COUNT(*) FROM cache").fetchone()[0] - self.max_entries
+        if overflow > 0:
+            conn.execute("DELETE FROM cache WHERE key IN (SELECT key FROM cache ORDER BY expires_at LIMIT ?)", (overflow,))
+            self._count('evictions', overflow)
+
+    def touch(self, key: str, ttl: int = 60, stale_ttl: int = 0) -> bool:
+        ''' Extends the lifetime of an unexpired entry; returns False if there is no such entry '''
+        now = time.time()
+        fresh_until = now + int(ttl)
+        return self._conn().execute(
+            "UPDATE cache SET fresh_until = ?, expires_at = ? WHERE key = ? AND expires_at >= ?",
+            (fresh_until, fresh_until + max(0, int(stale_ttl)), key, now),
+        ).rowcount == 1
+
+    def delete(self, key: str):
+        self._conn().execute("DELETE FROM cache WHERE key = ?", (key,))
+
+    def get_secret(self, key: str):
+        ''' Returns the unexpired secret stored under key, or None '''
+        row = self._conn().execute("SELECT expires_at, value FROM secrets WHERE key = ?", (key,)).fetchone()
+        if row is None or time.time() > row[0]:
+            return None
+        return json.loads(row[1])
+
+    def set_secret(self, key: str, value: Any, ttl: float = 60):
+        ''' Stores a secret for ttl seconds; secrets are never evicted to make room for entries '''
+        self._conn().execute(
+            "INSERT OR REPLACE INTO secrets (key, expires_at, value) VALUES (?, ?, ?)",
+            (key, time.time() + ttl, json.dumps(value)),
+        )
+
+    def ttl_left(self, key: str) -> int:
+        ''' Returns whole seconds until key stops being fresh, 0 if it is missing or stale '''
+        row = self._conn().execute("SELECT fresh_until FROM cache WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return 0
+        return max(0, int(row[0] - time.time()))
+
+    def sweep(self) -> int:
+        ''' Drops every expired entry and lock and returns how many entries were removed '''
+        now = time.time()
+        conn = self._conn()
+        removed = conn.execute("DELETE FROM cache WHERE expires_at < ?", (now,)).rowcount
+        conn.execute("DELETE FROM locks WHERE expires_at < ?", (now,))
+        conn.execute("DELETE FROM secrets WHERE expires_at < ?", (now,))
+        self._count('expirations', removed)
+        return removed
+
+    def acquire_lock(self, key: str, ttl: float = 30) -> bool:
+        ''' Takes the host-wide lock for key without blocking; expired locks are taken over '''
+        now = time.time()
+        owner = f"{self._owner_prefix}:{os.getpid()}:{threading.get_ident()}"
+        conn = self._conn()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute("DELETE FROM locks WHERE key = ? AND expires_at < ?", (key, now))
+            acquired = conn.execute(
+                "INSERT OR IGNORE INTO locks (key, owner, expires_at) VALUES (?, ?, ?)", (key, owner, now + ttl)
+            ).rowcount == 1
+            conn.execute("COMMIT")
+            return acquired
+        except sqlite3.Error:
+            try:
+                conn.execute("ROLLBACK")
+            except sqlite3.Error:
+                pass
+            return False
+
+    def release_lock(self, key: str):
+        owner = f"{self._owner_prefix}:{os.getpid()}:{threading.get_ident()}"
+        self._conn().execute("DELETE FROM locks WHERE key = ? AND owner = ?", (key, owner))
+
+    def is_locked(self, key: str) -> bool:
+        row = self._conn().execute("SELECT expires_at FROM locks WHERE key = ?", (key,)).fetchone()
+        return row is not None and row[0] >= time.time()
+
+    def stats(self) -> Dict[str, Any]:
+        row = self._conn().execute("SELECT COUNT(*), COALESCE(SUM(LENGTH(value)), 0) FROM cache").fetchone()
+        with self.lock:
+            stats = dict(self._stats)
+        stats['entries'] = row[0]
+        stats['bytes'] = row[1]
+        stats['max_entries'] = self.max_entries
+        stats['path'] = self.path
+        return stats
@@ -0,0 +1,131 @@
+import contextvars
+import json
+import logging
+import os
+import random
+import time
+import uuid
+from typing import Any, Dict, List
+
+# the trace of the request being handled by this thread (or greenlet)
+_current: contextvars.ContextVar = contextvars.ContextVar("dagsen_trace", default=None)
+
+
+class _NoopSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_noop = _NoopSpan()
+
+
+class Trace:
+    def __init__(self, request_id: str):
+        self.request_id = request_id
+        self.start = time.perf_counter()
+        self.depth = 0
+        # (name, start offset, duration, depth) in seconds, in the order the spans ended
+        self.spans: List[tuple] = []
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.start
+
+    def server_timing(self) -> str:
+        ''' Server-Timing header value: the time per span name (summed) and the total '''
+        totals: Dict[str, float] = {}
+        for name, _, duration, _ in self.spans:
+            totals[name] = totals.get(name, 0.0) + duration
+        parts = [f"{name};dur={duration * 1000:.2f}" for name, duration in totals.items()]
+        parts.append(f"total;dur={self.elapsed() * 1000:.2f}")
+        return ", ".join(parts)
+
+    def to_dict(self) -> Dict[str, Any]:
+        spans = sorted(self.spans, key=lambda span: span[1])
+        return {
+            "request_id": self.request_id,
+            "total_ms": round(self.elapsed() * 1000, 2),
+            "spans": [{"name": name, "start_ms": round(start * 1000, 2), "ms": round(duration * 1000, 2), "depth": depth}
+                      for name, start, duration, depth in spans],
+        }
+
+
+class _Span:
+    __slots__ = ("trace", "name", "t0")
+
+    def __init__(self, trace: Trace, name: str):
+        self.trace = trace
+        self.name = name
+
+    def __enter__(self):
+        self.t0 = time.perf_counter()
+        self.trace.depth += 1
+        return self
+
+    def __exit__(self, *exc):
+        trace = self.trace
+        trace.depth -= 1
+        trace.spans.append((self.name, self.t0 - trace.start, time.perf_counter() - self.t0, trace.depth))
+        return False
+
+
+# Optional per-request tracing: nested timing spans, reported in a Server-Timing header and
+# logged for slow (and a sample of all) requests. Disabled, span() hands out a shared no-op.
+class Tracer:
+    def __init__(self):
+        self.enabled = os.getenv("REQUEST_TRACING", "0").lower() in ("1", "true", "yes")
+        # requests slower than this are logged with their spans
+        try:
+            self.slow_seconds = float(os.getenv("TRACE_SLOW_MS", "500")) / 1000
+        except Exception:
+            self.slow_seconds = 0.5
+        # fraction of the slow requests that are logged, and of all other requests
+        try:
+            self.slow_sample_rate = float(os.getenv("TRACE_SLOW_SAMPLE_RATE", "1"))
+        except Exception:
+            self.slow_sample_rate = 1.0
+        try:
+            self.sample_rate = float(os.getenv("TRACE_SAMPLE_RATE", "0"))
+        except Exception:
+            self.sample_rate = 0.0
+        self.logger = logging.getLogger('dagsenAPI2.trace')
+        if self.enabled and not self.logger.handlers:
+            self.logger.setLevel(logging.INFO)
+            h = logging.StreamHandler()
+            h.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(message)s"))
+            self.logger.addHandler(h)
+
+    def start(self, request_id: str = None) -> Trace:
+        ''' Starts the trace of the current request; request_id defaults to a random id '''
+        trace = Trace(request_id or uuid.uuid4().hex[:16])
+        _current.set(trace)
+        return trace
+
+    def span(self, name: str):
+        ''' Context manager timing a part of the current request (no-op outside a trace) '''
+        if not self.enabled:
+            return _noop
+        trace = _current.get()
+        if trace is None:
+            return _noop
+        return _Span(trace, name)
+
+    def finish(self, **fields) -> Trace:
+        ''' Ends the current trace and logs it if it was slow or sampled. fields (path,
+            status...) are added to the log entry. Returns the trace, or None if there was none. '''
+        trace = _current.get()
+        if trace is None:
+            return None
+        _current.set(None)
+        slow = trace.elapsed() >= self.slow_seconds
+        rate = self.slow_sample_rate if slow else self.sample_rate
+        if rate > 0 and (rate >= 1 or random.random() < rate):
+            entry = trace.to_dict()
+            entry.update(fields)
+            if slow:
+                self.logger.warning("Slow request %s", json.dumps(entry))
+            else:
+                self.logger.info("Request trace %s", json.dumps(entry))
+        return trace
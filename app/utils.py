@@ -1,16 +1,28 @@
 import requests
+from requests.adapters import HTTPAdapter
 import os
 import datetime
 from dotenv import load_dotenv
-from flask import Response, request, render_template
 from typing import Dict, List, Any
+from collections import OrderedDict, deque
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor, Future, TimeoutError as FutureTimeoutError
 import json
-import copy
+import hashlib
+import base64
 import time
 import random
 import email.utils as email_utils
 import threading
 import logging
+import atexit
+try:
+    import fcntl
+except ImportError:  # not on Windows; concurrent snapshot writers then race
+    fcntl = None
+from .sqlite_cache import SQLiteCache, default_path as default_cache_path
+from .metrics import Metrics, mark_process_dead
+from .tracing import Tracer
 
 days = {
   'sv': [' ', u'Måndag', u'Tisdag', u'Onsdag', u'Torsdag', u'Fredag', u'Lördag', u'Söndag'],
@@ -18,16 +30,66 @@ days = {
   'fi': [' ', u'Maanantai', u'Tiistai', u'Keskiviikko', u'Torstai', u'Perjantai', u'Lauantai', u'Sunnuntai'],
 }
 
+language_aliases = {
+    'sv': 'sv',
+    'swe': 'sv',
+    'en': 'en',
+    'fi': 'fi',
+    'fin': 'fi'
+}
+
+# marks a meal option name entry without a name in index_menu
+_unnamed = object()
+
+
+# Read-only dict for cached menus: cache hits are shared between requests and threads, so
+# they are handed out as is and must never be modified. Still a dict for json and jinja.
+class FrozenDict(dict):
+    def _readonly(self, *args, **kwargs):
+        raise TypeError("cached menus are read-only")
+
+    __setitem__ = __delitem__ = clear = pop = popitem = setdefault = update = _readonly
+    __ior__ = _readonly
+
+    def __reduce__(self):
+        return (FrozenDict, (dict(self),))
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+
+@lru_cache(maxsize=512)
+def day_name(date: str, language: str) -> str:
+    ''' Returns the name of the weekday of date (YYYY-MM-DD) in language (sv, en, fi) '''
+    return days[language][datetime.date.fromisoformat(date).isoweekday()]
+
 
-# Very small in-process token-bucket rate limiter (per-process)
-class SimpleRateLimiter:
-    def __init__(self, rate: float = 1, per_seconds: float = 1.0):
-        # rate = tokens per per_seconds
-        self.capacity = float(rate)
-        self.tokens = float(rate)
-        self.fill_rate = float(rate) / float(per_seconds)
+# In-process token-bucket rate limiter shared by every upstream call of a client (per-process).
+# AIMD: the rate drops multiplicatively when upstream throttles us (and pauses for
+# Retry-After) and grows back additively with every successful call, up to max_rate.
+class AdaptiveRateLimiter:
+    def __init__(self, rate: float = 1, per_seconds: float = 1.0, min_rate: float = 0.2,
+                 increase: float = 0.05, decrease: float = 0.5):
+        # rates are tokens per per_seconds
+        self.per_seconds = float(per_seconds)
+        self.max_rate = float(rate)
+        self.min_rate = min(float(min_rate), self.max_rate)
+        self.increase = float(increase)
+        self.decrease = float(decrease)
+        self.rate = self.max_rate
+        self.capacity = max(1.0, self.rate)
+        self.tokens = self.capacity
+        self.fill_rate = self.rate / self.per_seconds
+        # may lie in the future while paused for Retry-After
         self.timestamp = time.time()
         self.lock = threading.Lock()
+        # waiters sleep on the condition and are woken when a 429 changes the schedule
+        self.condition = threading.Condition(self.lock)
+        self._stats = {'acquired': 0, 'waits': 0, 'wait_seconds': 0.0, 'max_wait_seconds': 0.0,
+                       'queue_depth': 0, 'max_queue_depth': 0, 'throttled': 0, 'timeouts': 0}
 
     def _add_tokens(self):
         now = time.time()
@@ -37,81 +99,683 @@ class SimpleRateLimiter:
         self.tokens = min(self.capacity, self.tokens + elapsed * self.fill_rate)
         self.timestamp = now
 
+    def _set_rate(self, rate: float):
+        self.rate = min(self.max_rate, max(self.min_rate, rate))
+        self.capacity = max(1.0, self.rate)
+        self.fill_rate = self.rate / self.per_seconds
+
     def allow(self) -> bool:
         with self.lock:
             self._add_tokens()
-            if self.tokens >= 1.0:
+            if self.tokens >= 1.0 and self.timestamp <= time.time():
                 self.tokens -= 1.0
+                self._stats['acquired'] += 1
                 return True
             return False
 
-    def acquire(self, block: bool = True, sleep_interval: float = 0.05) -> bool:
-        """Block until a token is available (or return False if not blocking)."""
+    def _wait_time(self, now: float, ahead: int = 0) -> float:
+        # seconds until a token is due for a caller with ahead callers before it
+        return max(0.0, self.timestamp - now) + max(0.0, 1.0 + ahead - self.tokens) / self.fill_rate
+
+    def acquire(self, block: bool = True, timeout: float = None) -> bool:
+        """Block until a token is available (or return False if not blocking, or if the
+        token would not be due within timeout seconds).
+        Waiters check the limiter again whenever they wake, so a pause or slowdown after a
+        429 also holds back the callers that were already waiting."""
         if not block:
             return self.allow()
-        while True:
-            if self.allow():
-                return True
-            time.sleep(sleep_interval)
+        with self.condition:
+            self._add_tokens()
+            now = time.time()
+            # callers already waiting are due first
+            wait = self._wait_time(now, ahead=self._stats['queue_depth'])
+            if timeout is not None and wait > timeout:
+                self._stats['timeouts'] += 1
+                return False
+            if wait > 0:
+                give_up_at = None if timeout is None else now + timeout
+                started = now
+                self._stats['waits'] += 1
+                self._stats['queue_depth'] += 1
+                self._stats['max_queue_depth'] = max(self._stats['max_queue_depth'], self._stats['queue_depth'])
+                try:
+                    while True:
+                        self.condition.wait(wait)
+                        self._add_tokens()
+                        now = time.time()
+                        if self.timestamp <= now and self.tokens >= 1.0:
+                            break
+                        wait = self._wait_time(now)
+                        if give_up_at is not None and now + wait > give_up_at:
+                            self._stats['timeouts'] += 1
+                            return False
+                finally:
+                    self._stats['queue_depth'] -= 1
+                    waited = time.time() - started
+                    self._stats['wait_seconds'] += waited
+                    self._stats['max_wait_seconds'] = max(self._stats['max_wait_seconds'], waited)
+            self.tokens -= 1.0
+            self._stats['acquired'] += 1
+        return True
+
+    def on_success(self):
+        ''' Additive increase after a call upstream accepted '''
+        with self.lock:
+            if self.rate < self.max_rate:
+                self._add_tokens()
+                self._set_rate(self.rate + self.increase)
+
+    def on_throttled(self, pause: float = 0.0):
+        ''' Multiplicative decrease after a 429; no tokens are handed out for pause seconds '''
+        with self.lock:
+            self._add_tokens()
+            self._set_rate(self.rate * self.decrease)
+            self._stats['throttled'] += 1
+            self.tokens = min(self.tokens, 0.0)
+            self.timestamp = max(self.timestamp, time.time() + max(0.0, pause))
+            self.condition.notify_all()
+
+    def stats(self) -> Dict[str, Any]:
+        with self.lock:
+            stats = dict(self._stats)
+            stats['rate'] = self.rate
+            stats['max_rate'] = self.max_rate
+        return stats
+
+
+# Circuit breaker for upstream calls. Opens when at least failure_rate of the calls in the
+# last window_seconds failed (and there were min_calls of them); while open every call is
+# rejected for open_seconds, after which a single trial call decides whether to close again.
+class CircuitBreaker:
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failure_rate: float = 0.5, min_calls: int = 5, window_seconds: float = 30,
+                 open_seconds: float = 30):
+        self.failure_rate = float(failure_rate)
+        self.min_calls = int(min_calls)
+        self.window_seconds = float(window_seconds)
+        self.open_seconds = float(open_seconds)
+        self.state = self.CLOSED
+        self._calls = deque()  # (timestamp, succeeded)
+        self._opened_at = 0.0
+        self._trial_started = None
+        self.lock = threading.Lock()
+        self._stats = {'opened': 0, 'rejected': 0, 'failures': 0, 'successes': 0}
+
+    def allow(self) -> bool:
+        ''' Returns whether a call may go upstream now '''
+        with self.lock:
+            now = time.time()
+            if self.state == self.OPEN:
+                if now < self._opened_at + self.open_seconds:
+                    self._stats['rejected'] += 1
+                    return False
+                self.state = self.HALF_OPEN
+                self._trial_started = None
+            if self.state == self.HALF_OPEN:
+                # one trial at a time; a trial that never reported back is given up on
+                if self._trial_started is not None and now < self._trial_started + self.open_seconds:
+                    self._stats['rejected'] += 1
+                    return False
+                self._trial_started = now
+            return True
+
+    def _trim(self, now: float):
+        while self._calls and self._calls[0][0] < now - self.window_seconds:
+            self._calls.popleft()
+
+    def _open(self, now: float):
+        self.state = self.OPEN
+        self._opened_at = now
+        self._calls.clear()
+        self._stats['opened'] += 1
+
+    def record_success(self):
+        with self.lock:
+            now = time.time()
+            self._stats['successes'] += 1
+            if self.state == self.HALF_OPEN:
+                self.state = self.CLOSED
+                self._calls.clear()
+            self._calls.append((now, True))
+            self._trim(now)
+
+    def record_failure(self):
+        with self.lock:
+            now = time.time()
+            self._stats['failures'] += 1
+            if self.state == self.HALF_OPEN:
+                self._open(now)
+                return
+            self._calls.append((now, False))
+            self._trim(now)
+            failures = sum(1 for _, succeeded in self._calls if not succeeded)
+            if len(self._calls) >= self.min_calls and failures >= self.failure_rate * len(self._calls):
+                self._open(now)
+
+    def stats(self) -> Dict[str, Any]:
+        with self.lock:
+            stats = dict(self._stats)
+            stats['state'] = self.state
+        return stats
+
+
+# Bounded in-process LRU cache with per-entry expiry and approximate memory accounting.
+# Entries are fresh for ttl seconds and may then be kept as stale for stale_ttl seconds.
+class TTLCache:
+    def __init__(self, max_entries: int = 1024, max_bytes: int = 16 * 1024 * 1024):
+        self.max_entries = int(max_entries)
+        self.max_bytes = int(max_bytes)
+        # key -> (fresh_until, expires_at, value, size, version); ordered from least to most recently used
+        self._data: "OrderedDict[str, tuple]" = OrderedDict()
+        self._bytes = 0
+        self.lock = threading.Lock()
+        self._stats = {'hits': 0, 'stale_hits': 0, 'misses': 0, 'evictions': 0, 'expirations': 0}
+
+    @staticmethod
+    def _sizeof(value: Any) -> int:
+        # Rough size of the cached value; menus are plain json-like data
+        try:
+            return len(json.dumps(value, ensure_ascii=False, default=str))
+        except Exception:
+            return 1024
+
+    def _remove(self, key: str):
+        item = self._data.pop(key, None)
+        if item is not None:
+            self._bytes -= item[3]
+
+    def get(self, key: str):
+        ''' Returns the value for key if it is fresh, otherwise None '''
+        entry = self.get_entry(key)
+        if entry is None or time.time() > entry[1]:
+            return None
+        return entry[0]
+
+    def get_entry(self, key: str):
+        ''' Returns (value, fresh_until) for key, including stale entries, or None '''
+        with self.lock:
+            item = self._data.get(key)
+            if item is None:
+                self._stats['misses'] += 1
+                return None
+            now = time.time()
+            if now > item[1]:
+                self._remove(key)
+                self._stats['expirations'] += 1
+                self._stats['misses'] += 1
+                return None
+            self._data.move_to_end(key)
+            self._stats['hits' if now <= item[0] else 'stale_hits'] += 1
+            return item[2], item[0]
+
+    def peek(self, key: str):
+        ''' Returns the value for key, including stale entries, without touching stats or LRU order '''
+        with self.lock:
+            item = self._data.get(key)
+            if item is None or time.time() > item[1]:
+                return None
+            return item[2]
+
+    def peek_version(self, key: str):
+        ''' Returns the version stored with the value for key, including stale entries, or None '''
+        with self.lock:
+            item = self._data.get(key)
+            if item is None or time.time() > item[1]:
+                return None
+            return item[4]
+
+    def set(self, key: str, value: Any, ttl: int = 60, stale_ttl: int = 0, version: Any = None):
+        ''' version is a small value identifying value (e.g. its digest), see peek_version '''
+        fresh_until = time.time() + int(ttl)
+        self.set_entry(key, value, fresh_until, fresh_until + max(0, int(stale_ttl)), version=version)
+
+    def set_entry(self, key: str, value: Any, fresh_until: float, expires_at: float, version: Any = None):
+        ''' Stores value with absolute fresh and expiry timestamps '''
+        size = self._sizeof(value)
+        with self.lock:
+            self._remove(key)
+            self._data[key] = (fresh_until, expires_at, value, size, version)
+            self._bytes += size
+            # Evict least recently used entries until within budget (always keep the new one)
+            while len(self._data) > 1 and (len(self._data) > self.max_entries or self._bytes > self.max_bytes):
+                oldest = next(iter(self._data))
+                self._remove(oldest)
+                self._stats['evictions'] += 1
+
+    def touch(self, key: str, ttl: int = 60, stale_ttl: int = 0) -> bool:
+        ''' Extends the lifetime of an unexpired entry as if it was set again with the same
+            value; returns False if there is no such entry '''
+        now = time.time()
+        with self.lock:
+            item = self._data.get(key)
+            if item is None or now > item[1]:
+                return False
+            fresh_until = now + int(ttl)
+            self._data[key] = (fresh_until, fresh_until + max(0, int(stale_ttl))) + item[2:]
+            self._data.move_to_end(key)
+            return True
+
+    def items(self, prefix: str = "") -> List[tuple]:
+        ''' Returns (key, value, fresh_until, expires_at) of every unexpired entry starting with prefix '''
+        now = time.time()
+        with self.lock:
+            return [(key, item[2], item[0], item[1]) for key, item in self._data.items()
+                    if key.startswith(prefix) and now <= item[1]]
+
+    def delete(self, key: str):
+        with self.lock:
+            self._remove(key)
+
+    def ttl_left(self, key: str) -> int:
+        ''' Returns whole seconds until key stops being fresh, 0 if it is missing or stale '''
+        with self.lock:
+            item = self._data.get(key)
+            if item is None:
+                return 0
+            return max(0, int(item[0] - time.time()))
+
+    def sweep(self) -> int:
+        ''' Drops every expired entry and returns how many were removed '''
+        now = time.time()
+        with self.lock:
+            expired = [key for key, item in self._data.items() if now > item[1]]
+            for key in expired:
+                self._remove(key)
+            self._stats['expirations'] += len(expired)
+        return len(expired)
+
+    def stats(self) -> Dict[str, int]:
+        with self.lock:
+            stats = dict(self._stats)
+            stats['entries'] = len(self._data)
+            stats['bytes'] = self._bytes
+            stats['max_entries'] = self.max_entries
+            stats['max_bytes'] = self.max_bytes
+        return stats
 
 
 # General class for the api client
 class APIClient:
 
     # Set variables from env
-    def __init__(self):
+    def __init__(self, site: Dict[str, Any] = None, shared: "APIClient" = None):
+        """
+        Parameters
+        site   - settings of the site this client serves (see sites.ClientRegistry); every
+                 setting left out is read from the environment
+        shared - client whose upstream connection pool, rate limiter, circuit breaker,
+                 worker pools and metrics this client uses instead of its own
+        """
         load_dotenv(override=True)
+        site = site or {}
+        self.site_id = site.get("id", "taffa")
         self.api_base_url: str = os.getenv("API_BASE_URL")
-        self.menu_name = os.getenv("MENU_NAME")
-        self.site_name = os.getenv("SITE_NAME")
-        self.api_password = os.getenv("API_PASSWORD")
-        self.api_username = os.getenv("API_USERNAME")
-        self.tenant = "tf" #FIXME: Change to env variable?
+        self.menu_name = site.get("menu_name") or os.getenv("MENU_NAME")
+        self.site_name = site.get("site_name") or os.getenv("SITE_NAME")
+        self.api_password = site.get("api_password") or os.getenv("API_PASSWORD")
+        self.api_username = site.get("api_username") or os.getenv("API_USERNAME")
+        self.tenant = site.get("tenant") or os.getenv("API_TENANT", "tf")
         self.token = ""
-        # simple per-process rate limiter: requests per second (default 3 req/sec)
+        self.token_expires_at = 0.0
+        self._token_lock = threading.Lock()
+        # bumped after every login attempt, so callers that waited for one do not log in again
+        self._login_generation = 0
+        self._login_failed_at = 0.0
+        # lifetime assumed for tokens that do not carry an exp claim, and how long before
+        # expiry a token is renewed
+        try:
+            self.token_ttl = int(os.getenv("TOKEN_TTL_SECONDS", "3600"))
+        except Exception:
+            self.token_ttl = 3600
+        try:
+            self.token_renew_margin = int(os.getenv("TOKEN_RENEW_MARGIN_SECONDS", "60"))
+        except Exception:
+            self.token_renew_margin = 60
+        # after a failed login, no new login is tried for this long
+        try:
+            self.login_retry_after = float(os.getenv("TOKEN_RETRY_SECONDS", "5"))
+        except Exception:
+            self.login_retry_after = 5.0
+        # adaptive per-process rate limiter: at most RATE_LIMIT requests per second
+        # (default 3 req/sec), backing off to RATE_LIMIT_MIN while upstream throttles us
         try:
             rl_rate = float(os.getenv("RATE_LIMIT", "3"))
         except Exception:
             rl_rate = 3.0
-        self.rate_limiter = SimpleRateLimiter(rate=rl_rate, per_seconds=1.0)
+        try:
+            rl_min_rate = float(os.getenv("RATE_LIMIT_MIN", "0.2"))
+        except Exception:
+            rl_min_rate = 0.2
+        try:
+            rl_increase = float(os.getenv("RATE_LIMIT_INCREASE", "0.05"))
+        except Exception:
+            rl_increase = 0.05
+        try:
+            rl_decrease = float(os.getenv("RATE_LIMIT_DECREASE", "0.5"))
+        except Exception:
+            rl_decrease = 0.5
+        self.rate_limiter = AdaptiveRateLimiter(rate=rl_rate, per_seconds=1.0, min_rate=rl_min_rate,
+                                                increase=rl_increase, decrease=rl_decrease)
+
+        # circuit breaker around upstream calls
+        try:
+            cb_failure_rate = float(os.getenv("CIRCUIT_FAILURE_RATE", "0.5"))
+        except Exception:
+            cb_failure_rate = 0.5
+        try:
+            cb_min_calls = int(os.getenv("CIRCUIT_MIN_CALLS", "5"))
+        except Exception:
+            cb_min_calls = 5
+        try:
+            cb_window = float(os.getenv("CIRCUIT_WINDOW_SECONDS", "30"))
+        except Exception:
+            cb_window = 30.0
+        try:
+            cb_open = float(os.getenv("CIRCUIT_OPEN_SECONDS", "30"))
+        except Exception:
+            cb_open = 30.0
+        self.circuit_breaker = CircuitBreaker(failure_rate=cb_failure_rate, min_calls=cb_min_calls,
+                                              window_seconds=cb_window, open_seconds=cb_open)
+        # longest date range (in calendar days) served by the range endpoints
+        try:
+            self.range_max_days = int(os.getenv("MENU_RANGE_MAX_DAYS", "31"))
+        except Exception:
+            self.range_max_days = 31
+        # time budget of one incoming request; upstream retries stop when it runs out
+        try:
+            self.request_deadline = float(os.getenv("REQUEST_DEADLINE_SECONDS", "8"))
+        except Exception:
+            self.request_deadline = 8.0
+
+        # pooled keep-alive session for upstream calls; pool size should match the
+        # number of server threads that may call upstream at the same time
+        try:
+            self.pool_size = int(os.getenv("UPSTREAM_POOL_SIZE", "10"))
+        except Exception:
+            self.pool_size = 10
+        try:
+            connect_timeout = float(os.getenv("UPSTREAM_CONNECT_TIMEOUT", "3.05"))
+        except Exception:
+            connect_timeout = 3.05
+        try:
+            read_timeout = float(os.getenv("UPSTREAM_READ_TIMEOUT", "5"))
+        except Exception:
+            read_timeout = 5.0
+        self.timeout = (connect_timeout, read_timeout)
+        self.session = self._new_session()
+        # multi-date requests are split into chunks of at most this many dates, fetched
+        # concurrently on the fanout pool
+        try:
+            self.upstream_max_dates = max(1, int(os.getenv("UPSTREAM_MAX_DATES", "10")))
+        except Exception:
+            self.upstream_max_dates = 10
+        self._fanout_executor = ThreadPoolExecutor(max_workers=self.pool_size, thread_name_prefix='menu-fanout')
 
         # logger per-instance; enable debug if API_DEBUG env var set
         self.logger = logging.getLogger('dagsenAPI2.APIClient')
-        self._metrics_enabled = os.getenv('API_DEBUG', '0').lower() in ('1', 'true', 'yes')
-        if self._metrics_enabled:
+        self.debug = os.getenv('API_DEBUG', '0').lower() in ('1', 'true', 'yes')
+        if self.debug:
             self.logger.setLevel(logging.DEBUG)
             if not self.logger.handlers:
                 h = logging.StreamHandler()
                 h.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(message)s"))
                 self.logger.addHandler(h)
 
+        # optional per-request timing spans (REQUEST_TRACING), see tracing.Tracer
+        self.tracer = Tracer()
+
         # cache ttl (seconds) for menus; default 60 seconds (1 minute)
         try:
             self.cache_ttl = int(os.getenv("MENU_CACHE_TTL_SECONDS", "60"))
         except Exception:
             self.cache_ttl = 60
+        # past the soft ttl above, stale menus are served while being refreshed in the
+        # background until the hard ttl; after that they are refetched synchronously and
+        # kept for the stale-if-error grace period in case upstream fails
+        try:
+            self.cache_hard_ttl = int(os.getenv("MENU_CACHE_HARD_TTL_SECONDS", "600"))
+        except Exception:
+            self.cache_hard_ttl = 600
+        try:
+            self.cache_stale_if_error = int(os.getenv("MENU_CACHE_STALE_IF_ERROR_SECONDS", "21600"))
+        except Exception:
+            self.cache_stale_if_error = 21600
+        self._refreshing = set()
+        self._refreshing_lock = threading.Lock()
+        self._refresh_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='menu-refresh')
+
+        # local in-process cache, bounded by entry count and approximate size
+        try:
+            cache_max_entries = int(os.getenv("MENU_CACHE_MAX_ENTRIES", "1024"))
+        except Exception:
+            cache_max_entries = 1024
+        try:
+            cache_max_bytes = int(os.getenv("MENU_CACHE_MAX_BYTES", str(16 * 1024 * 1024)))
+        except Exception:
+            cache_max_bytes = 16 * 1024 * 1024
+        self._local_cache = TTLCache(max_entries=cache_max_entries, max_bytes=cache_max_bytes)
+        # raw upstream payloads can instead live in a SQLite file shared by every worker on
+        # the host (MENU_CACHE_BACKEND=sqlite); derived views and bodies stay in process
+        self._shared_cache = None
+        if os.getenv("MENU_CACHE_BACKEND", "memory").lower() == "sqlite":
+            cache_path = os.getenv("MENU_CACHE_PATH") or default_cache_path()
+            self._shared_cache = SQLiteCache(cache_path, max_entries=cache_max_entries)
+        self._raw_cache = self._shared_cache if self._shared_cache is not None else self._local_cache
+        # short-lived negative entries: "empty" when upstream has no menu for a date, "error"
+        # when the upstream request failed
+        try:
+            self.negative_ttl = int(os.getenv("MENU_NEGATIVE_TTL_SECONDS", "30"))
+        except Exception:
+            self.negative_ttl = 30
+        try:
+            self.error_ttl = int(os.getenv("MENU_ERROR_TTL_SECONDS", "5"))
+        except Exception:
+            self.error_ttl = 5
+        self._negative_cache = TTLCache(max_entries=cache_max_entries, max_bytes=cache_max_bytes)
+        self._negative_counts = {'empty_hits': 0, 'error_hits': 0, 'empty_stored': 0, 'error_stored': 0}
+        # encoded response bodies (json, text, html) keyed by route, language and data version
+        try:
+            body_cache_max_entries = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "512"))
+        except Exception:
+            body_cache_max_entries = 512
+        self._body_cache = TTLCache(max_entries=body_cache_max_entries, max_bytes=cache_max_bytes)
+        try:
+            self.response_max_age = int(os.getenv("RESPONSE_MAX_AGE_SECONDS", "60"))
+        except Exception:
+            self.response_max_age = 60
+        # background sweep of expired entries (0 disables)
+        try:
+            self.cache_sweep_interval = float(os.getenv("MENU_CACHE_SWEEP_SECONDS", "60"))
+        except Exception:
+            self.cache_sweep_interval = 60.0
+        self._stop_event = threading.Event()
+        # in-flight upstream fetches per key; concurrent callers for the same key wait on
+        # the leader's future instead of fetching themselves
+        self._inflight: Dict[str, Future] = {}
+        self._inflight_lock = threading.Lock()
+        self.inflight_wait_timeout = 10
+        # with METRICS_DIR (set by gunicorn.conf.py) every worker writes its metrics there this
+        # often, and /taffa/metrics reports the sum over all workers
+        try:
+            self.metrics_flush_interval = float(os.getenv("METRICS_FLUSH_SECONDS", "5"))
+        except Exception:
+            self.metrics_flush_interval = 5.0
+        self._init_metrics()
 
-        # local in-process cache
-        self._local_cache: Dict[str, Any] = {}
-        self._local_cache_lock = threading.Lock()
-        # per-key locks to avoid thundering herd across threads in this process
-        self._locks: Dict[str, threading.Lock] = {}
-        self._locks_lock = threading.Lock()
-        # Simple in-process metrics for debugging (only enabled when API_DEBUG)
-        if self._metrics_enabled:
-            self._metrics = {
-                'upstream_fetch_count': 0,
-                'cache_hits': 0,
-                'cache_misses': 0,
-                'token_refreshes': 0,
-                'upstream_429s': 0,
-            }
+        # optional background prefetch of today and the next N serving days (0 disables)
+        try:
+            self.prefetch_days = int(site.get("prefetch_days", os.getenv("MENU_PREFETCH_DAYS", "0")))
+        except Exception:
+            self.prefetch_days = 0
+        try:
+            self.prefetch_interval = float(os.getenv("MENU_PREFETCH_INTERVAL_SECONDS", str(max(1, self.cache_ttl // 2))))
+        except Exception:
+            self.prefetch_interval = float(max(1, self.cache_ttl // 2))
+        try:
+            self.prefetch_jitter = float(os.getenv("MENU_PREFETCH_JITTER_SECONDS", "5"))
+        except Exception:
+            self.prefetch_jitter = 5.0
+        # optional on-disk snapshot of raw payloads for warm starts (memory backend only;
+        # the sqlite backend already persists in MENU_CACHE_PATH)
+        self.snapshot_path = os.getenv("MENU_SNAPSHOT_PATH") or None
+        if self.snapshot_path and shared is not None:
+            # one snapshot file per site
+            self.snapshot_path = f"{self.snapshot_path}.{self.site_id}"
+        try:
+            self.snapshot_interval = float(os.getenv("MENU_SNAPSHOT_INTERVAL_SECONDS", "300"))
+        except Exception:
+            self.snapshot_interval = 300.0
+        try:
+            self.snapshot_max_age = int(os.getenv("MENU_SNAPSHOT_MAX_AGE_SECONDS", "86400"))
+        except Exception:
+            self.snapshot_max_age = 86400
+        # written at exit by the process serving requests; close() drops this in a
+        # gunicorn master, which would otherwise overwrite its workers' snapshots
+        if self.snapshot_path and self._shared_cache is None:
+            atexit.register(self.save_snapshot)
+
+        # clients of other sites sharing this one's upstream resources (see _share)
+        self._primary = None
+        self._tenants = [self]
+        if shared is not None:
+            self._share(shared)
+
+        self._start_background_threads()
+
+
+    def _share(self, primary: "APIClient"):
+        ''' Uses the upstream connection pool, global rate budget, circuit breaker, worker
+            pools, metrics and tracer of primary; tokens and caches stay this client's own '''
+        self._primary = primary
+        self.session = primary.session
+        self.rate_limiter = primary.rate_limiter
+        self.circuit_breaker = primary.circuit_breaker
+        self._fanout_executor = primary._fanout_executor
+        self._refresh_executor = primary._refresh_executor
+        self.tracer = primary.tracer
+        for name, value in vars(primary).items():
+            if name == "metrics" or name.startswith("m_"):
+                setattr(self, name, value)
+        if self._shared_cache is not None and primary._shared_cache is not None \
+                and self._shared_cache.path == primary._shared_cache.path:
+            # keys carry the site and menu, so one host-wide cache serves every site
+            self._shared_cache = self._raw_cache = primary._shared_cache
+        primary._tenants.append(self)
+
+
+    def _init_metrics(self):
+        ''' Creates the metrics rendered by /taffa/metrics '''
+        self.metrics = Metrics(os.getenv("METRICS_DIR"))
+        m = self.metrics
+        self.m_requests = m.histogram("dagsen_request_seconds", "Time to answer a request", ("route", "format"))
+        self.m_render = m.histogram("dagsen_render_seconds", "Time to render a response body", ("route", "format"))
+        self.m_upstream_latency = m.histogram("dagsen_upstream_request_seconds", "Duration of upstream menu requests", ("status",))
+        self.m_rate_limiter_wait = m.histogram("dagsen_rate_limiter_wait_seconds", "Time waited for the upstream rate limiter")
+        self.m_singleflight_wait = m.histogram("dagsen_singleflight_wait_seconds", "Time waited for a fetch led by another thread")
+        self.m_parse_latency = m.histogram("dagsen_menu_parse_seconds", "Time to parse one day's payload into every language")
+        self.m_cache_lookups = m.counter("dagsen_cache_lookups_total",
+                                         "Menu cache lookups per date by result (view_hit: answered from parsed menus, the others from raw payloads)", ("result",))
+        self.m_token_refreshes = m.counter("dagsen_token_refreshes_total", "Upstream logins")
+        self.m_payloads = m.counter("dagsen_upstream_payloads_total", "Menu payloads fetched from upstream by change", ("change",))
+        m.gauge("dagsen_cache_entries", "Entries per cache, summed over the sites",
+                lambda: self._cache_totals('entries'), label="cache")
+        m.gauge("dagsen_cache_bytes", "Approximate size of each cache, summed over the sites",
+                lambda: self._cache_totals('bytes'), label="cache")
+        m.gauge("dagsen_inflight_fetches", "Upstream fetches currently in flight",
+                lambda: sum(len(tenant._inflight) for tenant in self._tenants))
+        m.gauge("dagsen_rate_limiter_rate", "Current upstream request rate limit per second",
+                lambda: self.rate_limiter.fill_rate)
+        m.gauge("dagsen_rate_limiter_queue_depth", "Callers waiting for the upstream rate limiter",
+                lambda: self.rate_limiter.stats()['queue_depth'])
+        m.gauge("dagsen_circuit_breaker_open", "1 while the upstream circuit breaker is open",
+                lambda: int(self.circuit_breaker.stats()['state'] != 'closed'))
+
+
+    def _caches(self) -> Dict[str, Any]:
+        caches = {'menus': self._local_cache, 'responses': self._body_cache, 'negative': self._negative_cache}
+        if self._shared_cache is not None:
+            caches['shared'] = self._shared_cache
+        return caches
+
+    def _cache_totals(self, stat: str) -> Dict[str, int]:
+        # sites may share a cache (the sqlite one), count each cache once
+        totals: Dict[str, int] = {}
+        seen = set()
+        for tenant in self._tenants:
+            for name, cache in tenant._caches().items():
+                if id(cache) not in seen:
+                    seen.add(id(cache))
+                    totals[name] = totals.get(name, 0) + cache.stats()[stat]
+        return totals
+
+
+    def _start_background_threads(self):
+        ''' Starts the cache sweeper and, when configured, the snapshot and prefetch threads '''
+        self._sweeper = None
+        if self.cache_sweep_interval > 0:
+            self._sweeper = threading.Thread(target=self._sweep_loop, name='menu-cache-sweeper', daemon=True)
+            self._sweeper.start()
+        self._snapshotter = None
+        if self.snapshot_path and self._shared_cache is None and self.snapshot_interval > 0:
+            self._snapshotter = threading.Thread(target=self._snapshot_loop, name='menu-snapshot', daemon=True)
+            self._snapshotter.start()
+        self._prefetcher = None
+        if self.prefetch_days > 0:
+            self._prefetcher = threading.Thread(target=self._prefetch_loop, name='menu-prefetch', daemon=True)
+            self._prefetcher.start()
+        if self._primary is None:
+            self.metrics.start_flusher(self.metrics_flush_interval, self._stop_event)
+
+
+    def after_fork(self):
+        ''' Rebuilds process-local state in a forked worker: threads do not survive a fork
+            and locks or pooled connections copied from the parent must not be reused.
+            A client sharing another's resources must be rebuilt after that one. '''
+        self._token_lock = threading.Lock()
+        self._local_cache.lock = threading.Lock()
+        self._body_cache.lock = threading.Lock()
+        self._negative_cache.lock = threading.Lock()
+        if self._shared_cache is not None:
+            self._shared_cache.lock = threading.Lock()
+        self._inflight = {}
+        self._inflight_lock = threading.Lock()
+        self._refreshing = set()
+        self._refreshing_lock = threading.Lock()
+        self._stop_event = threading.Event()
+        if self.snapshot_path and self._shared_cache is None:
+            atexit.unregister(self.save_snapshot)
+            atexit.register(self.save_snapshot)
+        if self._primary is not None:
+            self._share(self._primary)
         else:
-            self._metrics = None
+            self.session = self._new_session()
+            self.rate_limiter.lock = threading.Lock()
+            self.rate_limiter.condition = threading.Condition(self.rate_limiter.lock)
+            self.circuit_breaker.lock = threading.Lock()
+            self._refresh_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='menu-refresh')
+            self._fanout_executor = ThreadPoolExecutor(max_workers=self.pool_size, thread_name_prefix='menu-fanout')
+            self._tenants = [self]
+            # counters copied from the parent would be reported twice
+            self._init_metrics()
+        self._start_background_threads()
+
+
+    def _new_session(self) -> requests.Session:
+        ''' Creates a keep-alive session with a connection pool of pool_size '''
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        return session
 
 
-    def get_new_token(self):
-        ''' Get and set a new token for the api '''
+    def get_new_token(self, deadline: float = None):
+        ''' Get a new token for the api. deadline works as in make_request; None is
+            returned without logging in if the login cannot be done by then or the circuit
+            breaker is open. Raises if the login fails. '''
         url = f"{self.api_base_url}/login"
         body = \
         {
@@ -121,31 +785,132 @@ class APIClient:
         }
 
         try:
-            response = requests.post(url, json=body)
+            # logins count against the same upstream rate budget as menu requests
+            remaining = None if deadline is None else deadline - time.time()
+            if remaining is not None and remaining <= 0:
+                self.logger.warning("Deadline exceeded before logging in")
+                return None
+            with self.tracer.span("ratelimit"):
+                acquired = self.rate_limiter.acquire(timeout=remaining)
+            if not acquired:
+                self.logger.warning("Rate limiter wait would exceed the deadline for the login")
+                return None
+            if not self.circuit_breaker.allow():
+                self.logger.warning("Circuit open; not logging in")
+                return None
+            try:
+                response = self.session.post(url, json=body, timeout=self._request_timeout(deadline))
+            except requests.RequestException:
+                self.circuit_breaker.record_failure()
+                raise
+            if response.status_code >= 500:
+                self.circuit_breaker.record_failure()
+            else:
+                self.circuit_breaker.record_success()
             try:
                 token = response.json().get("token")
             except Exception:
                 token = None
-            if token and self._metrics_enabled and self._metrics is not None:
-                try:
-                    self._metrics['token_refreshes'] += 1
-                except Exception:
-                    pass
+            if not token:
+                raise ValueError(f"no token in login response (status {response.status_code})")
+            self.m_token_refreshes.inc()
             return token
-        except:
-            raise Exception("Error getting new token")
-    
+        except Exception as e:
+            raise Exception(f"Error getting new token: {e}")
 
-    def make_request(self, endpoint, retry=True):
+
+    def _token_expiry(self, token: str) -> float:
+        ''' Returns when token expires: the exp claim if it is a JWT, otherwise
+            TOKEN_TTL_SECONDS from now '''
+        try:
+            payload = token.split(".")[1]
+            claims = json.loads(base64.urlsafe_b64decode(payload + "=" * (-len(payload) % 4)))
+            return float(claims["exp"])
+        except Exception:
+            return time.time() + self.token_ttl
+
+
+    def _request_timeout(self, deadline: float = None):
+        ''' The (connect, read) timeout of an upstream call, cut to what is left until deadline '''
+        if deadline is None:
+            return self.timeout
+        remaining = max(deadline - time.time(), 0.001)
+        return (min(self.timeout[0], remaining), min(self.timeout[1], remaining))
+
+
+    def _ensure_token(self, deadline: float = None):
+        ''' Logs in before the first request and renews the token shortly before it expires,
+            so requests do not have to fail with 403 first '''
+        if self.token and time.time() < self.token_expires_at - self.token_renew_margin:
+            return
+        self._refresh_token(expired_token=self.token, deadline=deadline)
+
+
+    def _refresh_token(self, expired_token: str, deadline: float = None):
+        ''' Replaces expired_token and returns the new token. Concurrent callers are
+            coalesced into a single login: whoever waited on the lock reuses the outcome of
+            the login that finished meanwhile, even a failed one. After a failed login no
+            login is tried for TOKEN_RETRY_SECONDS. Another worker's token in the shared
+            cache is reused too. Neither the wait for another caller's login nor the login
+            itself goes past deadline. '''
+        generation = self._login_generation
+        lock_timeout = -1 if deadline is None else max(0.0, deadline - time.time())
+        if not self._token_lock.acquire(timeout=lock_timeout):
+            self.logger.warning("Deadline exceeded waiting for another login")
+            return self.token
+        try:
+            if self.token != expired_token or self._login_generation != generation:
+                return self.token
+            if time.time() < self._login_failed_at + self.login_retry_after:
+                self.logger.debug("Login failed recently; not retrying yet")
+                return self.token
+            token_key = f"token:{self.tenant}:{self.api_username}"
+            if self._shared_cache is not None:
+                shared = self._shared_cache.get_secret(token_key)
+                if isinstance(shared, (list, tuple)) and shared[0] != expired_token \
+                        and time.time() < shared[1] - self.token_renew_margin:
+                    self.token, self.token_expires_at = shared
+                    return self.token
+            try:
+                with self.tracer.span("login"):
+                    token = self.get_new_token(deadline=deadline)
+            except Exception as e:
+                self.logger.error(f"Token refresh failed: {e}")
+                self._login_generation += 1
+                self._login_failed_at = time.time()
+                return self.token
+            if not token:
+                # not tried: no time left or the circuit is open
+                return self.token
+            self._login_generation += 1
+            self._login_failed_at = 0.0
+            self.token = token
+            self.token_expires_at = self._token_expiry(token)
+            if self._shared_cache is not None:
+                self._shared_cache.set_secret(token_key, (token, self.token_expires_at),
+                                              ttl=max(1, self.token_expires_at - time.time()))
+            return token
+        finally:
+            self._token_lock.release()
+
+
+    def make_request(self, endpoint, retry=True, deadline=None):
             """
             Main function for making a request, handles token refreshment.
             Parameters:
             endpoint: str - the endpoint to call
             retry: bool - whether to retry the request (used once on failed 403)
+            deadline: float - time.time() by which the caller needs an answer; no attempt,
+                      limiter wait or backoff goes past it (None for no limit)
             Returns:
-            json response from the api
+            json response from the api (None on failure)
             """
             url = f"{self.api_base_url}/{endpoint}"
+            self._ensure_token(deadline=deadline)
+            if not self.token:
+                # the login failed; a request without a token would only get a 403
+                self.logger.warning(f"No API token; not calling {url}")
+                return None
             headers = {"authorization": self.token}
 
             max_attempts = 3
@@ -170,57 +935,90 @@ class APIClient:
                 except Exception:
                     return None
 
+            def _remaining():
+                return None if deadline is None else deadline - time.time()
+
             while attempt < max_attempts:
                 attempt += 1
+                remaining = _remaining()
+                if remaining is not None and remaining <= 0:
+                    self.logger.warning(f"Deadline exceeded before calling {url} (attempt {attempt})")
+                    return None
                 try:
-                    # Respect a simple per-process rate limit before calling external API
+                    # Respect the per-process rate limit before calling external API
+                    acquired = True
                     try:
-                        t0 = time.time()
-                        self.rate_limiter.acquire()
-                        waited = time.time() - t0
+                        t0 = time.perf_counter()
+                        with self.tracer.span("ratelimit"):
+                            acquired = self.rate_limiter.acquire(timeout=remaining)
+                        waited = time.perf_counter() - t0
+                        self.m_rate_limiter_wait.observe(waited)
                         if waited > 0.001:
                             self.logger.debug(f"Rate limiter wait: {waited:.3f}s for {url}")
                     except Exception:
                         # If limiter fails for any reason, proceed (fail-open)
                         pass
-                    # Instrumentation: count the actual call to upstream (only if enabled)
-                    if self._metrics_enabled and self._metrics is not None:
-                        try:
-                            self._metrics['upstream_fetch_count'] += 1
-                        except Exception:
-                            pass
+                    if not acquired:
+                        self.logger.warning(f"Rate limiter wait would exceed the deadline for {url}")
+                        return None
+                    # Fail fast while upstream is known to be down
+                    if not self.circuit_breaker.allow():
+                        self.logger.warning(f"Circuit open; not calling {url}")
+                        return None
                     # Perform the request. Avoid logging every successful call to reduce noise;
                     # only log non-2xx responses (or debug when enabled).
-                    response = requests.get(url, headers=headers, timeout=5)
+                    timeout = self._request_timeout(deadline)
+                    t0 = time.perf_counter()
+                    try:
+                        with self.tracer.span("upstream"):
+                            response = self.session.get(url, headers=headers, timeout=timeout)
+                    except requests.RequestException:
+                        self.m_upstream_latency.observe(time.perf_counter() - t0, status="error")
+                        self.circuit_breaker.record_failure()
+                        raise
+                    self.m_upstream_latency.observe(time.perf_counter() - t0, status=f"{response.status_code // 100}xx")
+                    if response.status_code >= 500:
+                        self.circuit_breaker.record_failure()
+                    else:
+                        self.circuit_breaker.record_success()
 
                     # If 403, refresh the token and retry (once)
                     if response.status_code == 403 and retry:
                         self.logger.info("Token expired. Attempting to refresh token...")
-                        self.token = self.get_new_token()
-                        return self.make_request(endpoint=endpoint, retry=False)
+                        if self._refresh_token(expired_token=headers["authorization"], deadline=deadline) == headers["authorization"]:
+                            self.logger.error(f"Could not renew the API token; not retrying {url}")
+                            return None
+                        return self.make_request(endpoint=endpoint, retry=False, deadline=deadline)
                     elif response.status_code == 403 and not retry:
                         raise PermissionError(f"Access forbidden / 403 even after refreshing token")
 
                     # Handle 429 - respect Retry-After if present, else exponential backoff with jitter
                     if response.status_code == 429:
-                        # Track and log rate-limited responses so we can debug upstream throttling.
-                        if self._metrics_enabled and self._metrics is not None:
-                            try:
-                                self._metrics['upstream_429s'] += 1
-                            except Exception:
-                                pass
                         retry_after = _parse_retry_after(response.headers.get("Retry-After"))
                         backoff = 2 ** (attempt - 1)
                         jitter = random.uniform(0, 1)
                         wait = (retry_after if retry_after is not None else backoff) + jitter
                         self.logger.warning(f"Upstream returned 429 for {url} (attempt {attempt}) retry-after={retry_after} wait={wait:.2f}s")
+                        # Slow down every caller of this client, not just this request; the
+                        # retry below waits for the limiter like everyone else
+                        self.rate_limiter.on_throttled(pause=wait)
                         if attempt < max_attempts:
-                            time.sleep(wait)
                             continue
                         else:
                             self.logger.warning(f"Exceeded retries after 429 for {url}")
                             return None
 
+                    # Server errors are retried like network errors
+                    if response.status_code >= 500:
+                        raise requests.HTTPError(f"Upstream returned {response.status_code}", response=response)
+
+                    # Other client errors (unknown site or menu, bad request...) won't change by
+                    # retrying; their error bodies must not be mistaken for a menu
+                    if not response.ok:
+                        self.logger.error(f"Upstream returned {response.status_code} for {url}: {response.text[:200]}")
+                        return None
+
+                    self.rate_limiter.on_success()
                     try:
                         parsed = response.json()
                         # Only debug-log successful responses when debug logging is enabled
@@ -241,9 +1039,12 @@ class APIClient:
                         return None
 
                 except requests.RequestException as e:
-                    # on network error, retry up to max_attempts
-                    if attempt < max_attempts:
-                        time.sleep((2 ** (attempt - 1)) + random.uniform(0, 1))
+                    # on network or server error, retry up to max_attempts within the deadline
+                    backoff = (2 ** (attempt - 1)) + random.uniform(0, 1)
+                    remaining = _remaining()
+                    if attempt < max_attempts and (remaining is None or backoff < remaining):
+                        with self.tracer.span("backoff"):
+                            time.sleep(backoff)
                         continue
                     self.logger.error(f"API request failed: {e} status: {response.status_code if response else 'no response'}")
                     return None
@@ -254,131 +1055,712 @@ class APIClient:
     
     # --- caching helpers (redis preferred, local fallback) ---
     def _cache_get(self, key: str):
-        with self._local_cache_lock:
-            item = self._local_cache.get(key)
-            if not item:
-                return None
-            expires_at, value = item
-            if time.time() > expires_at:
+        return self._local_cache.get(key)
+
+    def _cache_get_entry(self, key: str):
+        return self._raw_cache.get_entry(key)
+
+    def _cache_set(self, key: str, value: Any, ttl: int = 60, stale_ttl: int = 0):
+        self._local_cache.set(key, value, ttl=ttl, stale_ttl=stale_ttl)
+
+    def _cache_delete(self, key: str):
+        self._local_cache.delete(key)
+
+    def _cache_ttl_left(self, key: str) -> int:
+        return self._raw_cache.ttl_left(key)
+
+    def _count_negative(self, counter: str, n: int = 1):
+        with self._negative_cache.lock:
+            self._negative_counts[counter] += n
+
+    def _sweep_loop(self):
+        while not self._stop_event.wait(self.cache_sweep_interval):
+            try:
+                removed = self._local_cache.sweep() + self._body_cache.sweep() + self._negative_cache.sweep()
+                if self._shared_cache is not None:
+                    removed += self._shared_cache.sweep()
+                if removed:
+                    self.logger.debug(f"Cache sweep removed {removed} expired entries")
+            except Exception:
+                self.logger.exception("Cache sweep failed")
+
+    def _prefetch_loop(self):
+        # Warm up right away, then refresh on the interval (with jitter) and at midnight,
+        # when the set of serving days rolls over
+        while not self._stop_event.is_set():
+            try:
+                refreshed = self.prefetch()
+                if refreshed:
+                    self.logger.debug(f"Prefetched menus for {refreshed}")
+            except Exception:
+                self.logger.exception("Menu prefetch failed")
+            now = datetime.datetime.now()
+            midnight = datetime.datetime.combine(now.date() + datetime.timedelta(days=1), datetime.time())
+            wait = self.prefetch_interval + random.uniform(0, self.prefetch_jitter)
+            wait = min(wait, (midnight - now).total_seconds() + 1)
+            if self._stop_event.wait(wait):
+                break
+
+    def prefetch(self, days: int = None) -> List[str]:
+        ''' Refreshes the cached menus of today and the next `days` serving days that would
+            go stale before the next prefetch round, in one upstream request.
+            Returns the refreshed dates. '''
+        if days is None:
+            days = self.prefetch_days
+        margin = self.prefetch_interval + self.prefetch_jitter
+        dates = [date for date in self.next_meal_dates(int(days) + 1)
+                 if self._cache_ttl_left(self._raw_key(date)) <= margin
+                 and self._negative_cache.get(self._raw_key(date)) is None]
+        # drop duplicates (next_meal_date(0) may equal next_meal_date(1) on weekends)
+        dates = list(dict.fromkeys(dates))
+        if not dates:
+            return []
+        return self._lead_fetch(dates)
+
+    def _snapshot_loop(self):
+        while not self._stop_event.wait(self.snapshot_interval):
+            try:
+                self.save_snapshot()
+            except Exception:
+                self.logger.exception("Saving cache snapshot failed")
+
+    def save_snapshot(self, path: str = None) -> int:
+        ''' Writes the cached raw upstream payloads with their timestamps to path
+            (default MENU_SNAPSHOT_PATH). Every worker process saves to the same file, so
+            entries already in it are kept unless expired or older than this process's
+            copy. Returns the number of entries written. '''
+        path = path or self.snapshot_path
+        if not path or self._shared_cache is not None:
+            return 0
+        entries = {
+            key: {"key": key, "value": value, "fresh_until": fresh_until, "expires_at": expires_at}
+            for key, value, fresh_until, expires_at in self._local_cache.items(prefix="raw:")
+        }
+        lock_file = open(f"{path}.lock", "a")
+        try:
+            if fcntl is not None:
+                # one writer at a time, or entries merged by another worker could be lost
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            now = time.time()
+            try:
+                with open(path, encoding="utf-8") as f:
+                    previous = json.load(f).get("entries", [])
+            except (OSError, ValueError):
+                previous = []
+            for entry in previous:
                 try:
-                    del self._local_cache[key]
-                except KeyError:
-                    pass
-                return None
-            return value
+                    key = entry["key"]
+                    if now > entry["expires_at"]:
+                        continue
+                    ours = entries.get(key)
+                    # values are (payload, modified_at, digest): keep the newer payload
+                    if ours is None or entry["value"][1] > ours["value"][1]:
+                        entries[key] = entry
+                except (KeyError, TypeError, IndexError):
+                    continue
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({"saved_at": now, "entries": list(entries.values())}, f, ensure_ascii=False)
+            # atomic replace so a crash mid-write never leaves a truncated snapshot
+            os.replace(tmp_path, path)
+        finally:
+            lock_file.close()
+        self.logger.debug(f"Saved {len(entries)} cache entries to {path}")
+        return len(entries)
+
+    def load_snapshot(self, path: str = None) -> int:
+        ''' Restores raw upstream payloads saved by save_snapshot, skipping past days and
+            payloads older than MENU_SNAPSHOT_MAX_AGE_SECONDS. Returns the number restored. '''
+        path = path or self.snapshot_path
+        if not path or self._shared_cache is not None or not os.path.exists(path):
+            return 0
+        try:
+            with open(path, encoding="utf-8") as f:
+                snapshot = json.load(f)
+        except (OSError, ValueError) as e:
+            self.logger.warning(f"Ignoring unreadable cache snapshot {path}: {e}")
+            return 0
+        now = time.time()
+        today = datetime.date.today().isoformat()
+        restored = 0
+        for entry in snapshot.get("entries", []):
+            try:
+                key = entry["key"]
+                day_list, modified_at = entry["value"][:2]
+                if key.rsplit(":", 1)[-1] < today or now - modified_at > self.snapshot_max_age:
+                    continue
+                if now > entry["expires_at"] or self._local_cache.peek(key) is not None:
+                    continue
+                # snapshots from before payload digests get one on load
+                digest = entry["value"][2] if len(entry["value"]) > 2 else self._payload_digest(day_list)
+                self._local_cache.set_entry(key, (day_list, modified_at, digest), entry["fresh_until"], entry["expires_at"],
+                                            version=(digest, modified_at))
+                restored += 1
+            except (KeyError, TypeError, ValueError):
+                continue
+        self.logger.info(f"Restored {restored} cache entries from {path}")
+        return restored
 
-    def _cache_set(self, key: str, value: Any, ttl: int = 60):
-        with self._local_cache_lock:
-            self._local_cache[key] = (time.time() + int(ttl), value)
+    def stats(self) -> Dict[str, Any]:
+        ''' Returns the cache, rate limiter and circuit breaker statistics '''
+        return {'cache': self.cache_stats(), 'rate_limiter': self.rate_limiter.stats(),
+                'circuit_breaker': self.circuit_breaker.stats()}
 
-    def _acquire_lock(self, lock_key: str, lock_ttl: int = 30) -> bool:
-        # Use per-key lock in-process to avoid multiple threads fetching the same key
-        with self._locks_lock:
-            lock = self._locks.get(lock_key)
-            if lock is None:
-                lock = threading.Lock()
-                self._locks[lock_key] = lock
-        # Try to acquire non-blocking
+    def cache_stats(self) -> Dict[str, int]:
+        ''' Returns hit, miss, eviction and size counters for the menu cache '''
+        stats = self._local_cache.stats()
+        stats['responses'] = self._body_cache.stats()
+        stats['negative'] = self._negative_cache.stats()
+        with self._negative_cache.lock:
+            stats['negative'].update(self._negative_counts)
+        if self._shared_cache is not None:
+            stats['shared'] = self._shared_cache.stats()
+        with self._inflight_lock:
+            stats['inflight'] = len(self._inflight)
+        return stats
+
+    def close(self):
+        ''' Stops background threads and closes the upstream session owned by this client.
+            The snapshot is no longer saved at exit (after_fork registers it again). '''
+        self._stop_event.set()
+        atexit.unregister(self.save_snapshot)
+        if self._primary is not None:
+            # the session and pools belong to the primary client
+            return
+        self._refresh_executor.shutdown(wait=False)
+        self._fanout_executor.shutdown(wait=False)
         try:
-            return lock.acquire(blocking=False)
+            self.session.close()
         except Exception:
-            return False
+            pass
+        if self.metrics.directory is not None:
+            # no longer reported as a live worker; its counters are kept
+            self.metrics.flush()
+            mark_process_dead(self.metrics.directory, os.getpid())
 
-    def _release_lock(self, lock_key: str):
-        # Release in-process per-key lock
-        with self._locks_lock:
-            lock = self._locks.get(lock_key)
-        if lock:
-            try:
-                if lock.locked():
-                    lock.release()
-            except RuntimeError:
-                pass
-            
+    def _join_flight(self, key: str):
+        ''' Returns (future, is_leader) for key. The leader must fetch and call
+            _finish_flight; everyone else waits on the future for the leader's result. '''
+        with self._inflight_lock:
+            future = self._inflight.get(key)
+            if future is not None:
+                return future, False
+            future = Future()
+            self._inflight[key] = future
+            return future, True
+
+    def _finish_flight(self, key: str, result: Any = None, error: BaseException = None):
+        # Hand the result (or error) to every waiter and drop the flight from the table
+        with self._inflight_lock:
+            future = self._inflight.pop(key, None)
+        if future is None:
+            return
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
 
-    def fetch_menu(self, date: str, language: str) -> Dict[str, Any] : 
+
+    def fetch_menu(self, date: str, language: str, deadline: float = None) -> Dict[str, Any] : 
         """ Fetches the menu for one day from the api and returns Dictionary with the menu 
             like in menu_to_json
         Parameters
-        Dates - Comma separated list of dates in format YYYY-MM-DD
+        date     - date in format YYYY-MM-DD
+        language - language (sv, en, fi)
+        deadline - time.time() by which an answer is needed (see make_request)
         Returns
         """
         # Ensure date is a string; fall back to today if missing
         if not date:
             date = datetime.date.today().isoformat()
-        endpoint = f"public/publicmenu/dates/{self.site_name}?dates={date}&menu={self.menu_name}"
+        return self.fetch_menus(dates=[date], language=language, deadline=deadline)[0]
 
-        cache_key = f"menu:{self.site_name}:{date}:{language}"
 
-        # Try cache first
-        cached = self._cache_get(cache_key)
-        if cached is not None:
-            self.logger.debug(f"Cache hit for {cache_key}")
-            if self._metrics_enabled and self._metrics is not None:
-                try:
-                    self._metrics['cache_hits'] += 1
-                except Exception:
-                    pass
-            return cached
-        else:
-            self.logger.debug(f"Cache miss for {cache_key}")
-            if self._metrics_enabled and self._metrics is not None:
-                try:
-                    self._metrics['cache_misses'] += 1
-                except Exception:
-                    pass
+    def fetch_menus(self, dates: List[str], language: str, deadline: float = None) -> List[Dict[str, Any]]:
+        """ Fetches the menus for several days and returns them like in menu_to_json.
+            Menus are built from the language-independent raw payload cache, so every
+            language shares one upstream fetch per date.
+        Parameters
+        dates    - list of dates in format YYYY-MM-DD
+        language - language (sv, en, fi)
+        deadline - time.time() by which an answer is needed (see make_request)
+        Returns
+        list of menus like in menu_to_json, in the same order as dates
+        """
+        language = self.normalize_language(language)
+        menus, _ = self.fetch_menus_multi(dates=dates, languages=[language], deadline=deadline)
+        return menus[language]
 
-        # attempt to acquire a distributed lock so only one process fetches at a time
-        lock_key = cache_key + ":lock"
-        lock_ttl = max(10, int(self.cache_ttl))  # lock for at least cache ttl or 10s
 
-        got_lock = self._acquire_lock(lock_key, lock_ttl)
-        if got_lock:
-            self.logger.debug(f"Acquired lock for {lock_key}")
-            try:
-                response = self.make_request(endpoint=endpoint)
-                self.logger.debug(f"Raw API response for {date} ({language}): {response}")
-                if not response:
-                    # don't cache negative responses; return an empty menu structure
-                    self.logger.debug(f"Upstream returned no data for {endpoint}")
-                    return self.menu_to_json(menu_list=[], language=language, date=date)
-                result = self.menu_to_json(menu_list=response, language=language, date=date)
-                # cache parsed menu (store a deep copy to avoid callers mutating the cached object)
+    def fetch_menus_multi(self, dates: List[str], languages: List[str], deadline: float = None) -> tuple:
+        """ Fetches the menus for several days in several languages at once. Dates missing
+            a cached view in any of the languages are fetched in one batch, and each raw
+            payload is parsed once for all languages.
+        Parameters
+        dates     - list of dates in format YYYY-MM-DD
+        languages - list of languages (sv, en, fi)
+        deadline  - time.time() by which an answer is needed (see make_request)
+        Returns
+        ({language: list of menus like in menu_to_json, in the same order as dates},
+         versions: (payload digest, modified_at or None) of the payload each date's menus
+         were built from, in the same order as dates; see cached_body)
+        """
+        languages = list(dict.fromkeys(self.normalize_language(language) for language in languages))
+        results: Dict[str, Dict[str, Dict[str, Any]]] = {language: {} for language in languages}
+        versions: Dict[str, tuple] = {}
+        missing = []
+        with self.tracer.span("views"):
+            for date in dates:
+                if date in versions or date in missing:
+                    continue
+                # Views live in this process, while the payload may have been replaced by
+                # another worker (shared cache), so they are only used if built from the
+                # payload cached now. Only its version is read, not the payload itself.
+                version = self._raw_cache.peek_version(self._raw_key(date))
+                digest = version[0] if version is not None else None
+                views = {}
+                if digest is not None:
+                    for language in languages:
+                        cached = self._cache_get(self._view_key(date, language))
+                        if cached is None or cached[0] != digest:
+                            break
+                        views[language] = cached[1]
+                if len(views) == len(languages):
+                    self.m_cache_lookups.inc(result="view_hit")
+                    for language, view in views.items():
+                        results[language][date] = view
+                    versions[date] = (digest, version[1])
+                else:
+                    missing.append(date)
+
+        if missing:
+            raw_menus = self.fetch_raw_menus(missing, deadline=deadline)
+            for date in missing:
+                day_list = raw_menus.get(date) or []
+                if not day_list:
+                    for language in languages:
+                        results[language][date] = self.menu_to_json(menu_list=day_list, language=language, date=date)
+                    versions[date] = ("empty", None)
+                    continue
+                # Views are cached as (payload digest, view) and stay fresh no longer than the
+                # raw payload. Once stale they are kept around, and reused as long as the
+                # payload's digest still matches, so an unchanged payload is never parsed again.
+                raw_entry = self._raw_cache.peek(self._raw_key(date))
+                digest = raw_entry[2] if raw_entry is not None and len(raw_entry) > 2 and raw_entry[0] == day_list else None
+                views = {}
+                if digest is not None:
+                    for view_language in days:
+                        cached = self._local_cache.peek(self._view_key(date, view_language))
+                        if cached is None or cached[0] != digest:
+                            break
+                        views[view_language] = cached[1]
+                if len(views) != len(days):
+                    # One parse of the payload serves every language
+                    with self.tracer.span("parse"):
+                        t0 = time.perf_counter()
+                        index = self.index_menu(day_list)
+                        views = {view_language: FrozenDict(self.menu_to_json(menu_list=day_list, language=view_language, date=date, index=index))
+                                 for view_language in days}
+                        self.m_parse_latency.observe(time.perf_counter() - t0)
+                    if digest is not None:
+                        ttl_left = self._cache_ttl_left(self._raw_key(date))
+                        for view_language, view in views.items():
+                            self._cache_set(self._view_key(date, view_language), (digest, view), ttl=ttl_left, stale_ttl=self._view_stale_ttl())
+                else:
+                    # the payload was refreshed unchanged elsewhere (another worker): keep
+                    # serving these views from the fast path for as long as it is fresh
+                    ttl_left = self._cache_ttl_left(self._raw_key(date))
+                    for view_language in days:
+                        self._local_cache.touch(self._view_key(date, view_language), ttl=ttl_left, stale_ttl=self._view_stale_ttl())
+                for view_language in languages:
+                    results[view_language][date] = views[view_language]
+                if digest is not None:
+                    versions[date] = (digest, raw_entry[1])
+                else:
+                    # built from a payload no longer (or not yet) cached, e.g. a stale one
+                    # served while upstream fails
+                    versions[date] = (self._payload_digest(day_list), None)
+
+        return ({language: [results[language][date] for date in dates] for language in languages},
+                tuple(versions[date] for date in dates))
+
+
+    def fetch_raw_menus(self, dates: List[str], deadline: float = None) -> Dict[str, List[Any]]:
+        """ Fetches the raw upstream payloads for several days, requesting every date
+            missing from the cache in a single upstream call.
+            Entries past the soft TTL are served stale while they are refreshed in the
+            background; past the hard TTL they are refetched, and only used again if
+            upstream fails.
+        Parameters
+        dates    - list of dates in format YYYY-MM-DD
+        deadline - time.time() by which an answer is needed (see make_request)
+        Returns
+        dict of date -> menu_list for that date (empty list when there is no menu)
+        """
+        results: Dict[str, List[Any]] = {}
+        missing = []
+        stale: Dict[str, List[Any]] = {}
+        refresh = []
+        now = time.time()
+        revalidate_window = max(0, self.cache_hard_ttl - self.cache_ttl)
+        with self.tracer.span("cache"):
+            for date in dates:
+                if date in results or date in missing:
+                    continue
+                entry = self._cache_get_entry(self._raw_key(date))
+                if entry is not None and now <= entry[1]:
+                    self.logger.debug(f"Cache hit for {self._raw_key(date)}")
+                    self.m_cache_lookups.inc(result="hit")
+                    results[date] = entry[0][0]
+                    continue
+                # checked before revalidating a stale entry, so a recent failure or missing
+                # menu is not asked for again on every request
+                negative = self._negative_cache.get(self._raw_key(date))
+                if negative is not None:
+                    # upstream recently had no menu for this date, or failed: don't ask again yet
+                    self.logger.debug(f"Negative cache hit ({negative}) for {self._raw_key(date)}")
+                    self._count_negative(f"{negative}_hits")
+                    self.m_cache_lookups.inc(result=f"negative_{negative}")
+                    results[date] = entry[0][0] if entry is not None and negative == "error" else []
+                elif entry is not None and now <= entry[1] + revalidate_window:
+                    self.logger.debug(f"Stale cache hit for {self._raw_key(date)}; refreshing in background")
+                    self.m_cache_lookups.inc(result="stale")
+                    results[date] = entry[0][0]
+                    refresh.append(date)
+                else:
+                    self.logger.debug(f"Cache miss for {self._raw_key(date)}")
+                    self.m_cache_lookups.inc(result="miss")
+                    if entry is not None:
+                        # past the hard TTL; only served again if upstream fails
+                        stale[date] = entry[0][0]
+                    missing.append(date)
+
+        if refresh:
+            self._refresh_in_background(refresh)
+
+        # Lead the fetch for every missing date nobody else is fetching; dates already
+        # in flight in another thread are waited for below.
+        leading = []
+        following: Dict[str, Future] = {}
+        for date in missing:
+            future, is_leader = self._join_flight(self._raw_key(date))
+            if is_leader:
+                leading.append(date)
+            else:
+                following[date] = future
+
+        if leading:
+            with self.tracer.span("fetch"):
                 try:
-                    self._cache_set(cache_key, copy.deepcopy(result), ttl=self.cache_ttl)
-                except Exception:
-                    # Fallback: store the original if deepcopy fails for some reason
-                    self._cache_set(cache_key, result, ttl=self.cache_ttl)
-                return result
-            finally:
+                    fetched = self._fetch_and_store(leading, deadline=deadline)
+                except BaseException as e:
+                    for date in leading:
+                        self._finish_flight(self._raw_key(date), error=e)
+                    raise
+                for date in leading:
+                    # None tells waiters that upstream failed, [] that there is no menu
+                    day_list = fetched.get(date)
+                    self._finish_flight(self._raw_key(date), result=day_list)
+                    if day_list is None and date in stale:
+                        self.logger.warning(f"Upstream failed; serving stale menu for {date}")
+                        results[date] = stale[date]
+                    else:
+                        results[date] = day_list or []
+
+        if following:
+            with self.tracer.span("singleflight"):
+                for date, future in following.items():
+                    cache_key = self._raw_key(date)
+                    self.logger.debug(f"Another thread is fetching {cache_key}; waiting for its result")
+                    timeout = self.inflight_wait_timeout
+                    if deadline is not None:
+                        timeout = max(0, min(timeout, deadline - time.time()))
+                    t0 = time.perf_counter()
+                    try:
+                        day_list = future.result(timeout=timeout)
+                    except FutureTimeoutError:
+                        self.logger.debug(f"Timed out waiting for {cache_key}; returning stale or empty menu")
+                        day_list = None
+                    except Exception as e:
+                        self.logger.error(f"Fetch of {cache_key} failed in another thread: {e}")
+                        day_list = None
+                    self.m_singleflight_wait.observe(time.perf_counter() - t0)
+                    if day_list is None:
+                        day_list = stale.get(date, [])
+                    results[date] = day_list
+
+        return results
+
+
+    def _fetch_and_store(self, dates: List[str], deadline: float = None) -> Dict[str, Any]:
+        """ Fetches dates from upstream in one call and caches every non-empty day.
+            The caller must lead the flights for these dates. With a shared cache, dates
+            another process on this host is already fetching are waited for instead.
+        Returns
+        dict of date -> menu_list, None for dates whose upstream request failed
+        """
+        if self._shared_cache is None:
+            return self._fetch_upstream(dates, deadline=deadline)
+        owned = [date for date in dates
+                 if self._shared_cache.acquire_lock(self._raw_key(date) + ":lock", ttl=self.inflight_wait_timeout)]
+        results: Dict[str, Any] = {}
+        try:
+            if owned:
+                results.update(self._fetch_upstream(owned, deadline=deadline))
+        finally:
+            for date in owned:
                 try:
-                    self._release_lock(lock_key)
+                    self._shared_cache.release_lock(self._raw_key(date) + ":lock")
                 except Exception:
                     pass
-        else:
-            self.logger.debug(f"Another process is fetching {cache_key}; waiting for cache")
-            # another process is fetching; wait briefly for cache to appear
-            wait_until = time.time() + 10
-            while time.time() < wait_until:
-                time.sleep(0.5)
-                cached = self._cache_get(cache_key)
-                if cached is not None:
-                    self.logger.debug(f"Cache filled for {cache_key} while waiting")
-                    return cached
-            # timed out waiting; fallback to empty menu
-            self.logger.debug(f"Timed out waiting for cache for {cache_key}; returning empty menu")
-            return self.menu_to_json(menu_list=[], language=language, date=date)
-
-        # Unreachable
-        
-    
+        others = [date for date in dates if date not in owned]
+        if others:
+            results.update(self._wait_for_shared(others, deadline=deadline))
+        return results
+
+
+    def _fetch_upstream(self, dates: List[str], deadline: float = None) -> Dict[str, Any]:
+        # Long date lists are split into chunks of upstream_max_dates fetched concurrently
+        if len(dates) > self.upstream_max_dates:
+            chunks = [dates[i:i + self.upstream_max_dates] for i in range(0, len(dates), self.upstream_max_dates)]
+            results: Dict[str, Any] = {}
+            for chunk_result in self._fanout_executor.map(lambda chunk: self._fetch_upstream(chunk, deadline=deadline), chunks):
+                results.update(chunk_result)
+            return results
+        self.logger.debug(f"Fetching {len(dates)} dates from upstream: {dates}")
+        endpoint = f"public/publicmenu/dates/{self.site_name}?dates={','.join(dates)}&menu={self.menu_name}"
+        response = self.make_request(endpoint=endpoint, deadline=deadline)
+        self.logger.debug(f"Raw API response for {dates}: {response}")
+        if response is not None and not isinstance(response, list):
+            # the menu endpoint returns a list of days; anything else is an error object
+            self.logger.error(f"Unexpected upstream response for {dates}: {str(response)[:200]}")
+            response = None
+        if response is None:
+            for date in dates:
+                self._negative_cache.set(self._raw_key(date), "error", ttl=self.error_ttl)
+            self._count_negative("error_stored", len(dates))
+            return {date: None for date in dates}
+        per_date = self._split_menu_by_date(response, dates)
+        # keep entries around past the hard TTL so they can be served if upstream fails
+        stale_ttl = max(0, self.cache_hard_ttl - self.cache_ttl) + self.cache_stale_if_error
+        for date in dates:
+            day_list = per_date.get(date, [])
+            if day_list:
+                # raw entries are (payload, modified_at, digest); modified_at versions the derived
+                # responses. An unchanged payload only extends the lifetime of the cached one and
+                # its views, so nothing is parsed or rendered again and ETags stay the same.
+                digest = self._payload_digest(day_list)
+                previous = self._raw_cache.peek(self._raw_key(date))
+                if previous is not None and len(previous) > 2 and previous[2] == digest \
+                        and self._raw_cache.touch(self._raw_key(date), ttl=self.cache_ttl, stale_ttl=stale_ttl):
+                    self.m_payloads.inc(change="unchanged")
+                    day_list = previous[0]
+                    for view_language in days:
+                        self._local_cache.touch(self._view_key(date, view_language), ttl=self.cache_ttl, stale_ttl=self._view_stale_ttl())
+                else:
+                    self.m_payloads.inc(change="changed" if previous is not None else "new")
+                    modified_at = time.time()
+                    self._raw_cache.set(self._raw_key(date), (day_list, modified_at, digest), ttl=self.cache_ttl,
+                                        stale_ttl=stale_ttl, version=(digest, modified_at))
+                    # drop views derived from an older payload
+                    for view_language in days:
+                        self._cache_delete(self._view_key(date, view_language))
+                self._negative_cache.delete(self._raw_key(date))
+            else:
+                # no menu (yet): remember that briefly so it is re-checked soon, but not on every hit
+                self.logger.debug(f"Upstream returned no data for {date}")
+                self._negative_cache.set(self._raw_key(date), "empty", ttl=self.negative_ttl)
+                # a withdrawn menu must not be served (or revalidated) any longer
+                self._raw_cache.delete(self._raw_key(date))
+                for view_language in days:
+                    self._cache_delete(self._view_key(date, view_language))
+                self._count_negative("empty_stored")
+            per_date[date] = day_list
+        return per_date
+
+
+    def _wait_for_shared(self, dates: List[str], deadline: float = None) -> Dict[str, Any]:
+        ''' Waits for other processes fetching dates to store them in the shared cache '''
+        self.logger.debug(f"Another process is fetching {dates}; waiting for the shared cache")
+        results: Dict[str, Any] = {}
+        waiting = list(dates)
+        wait_until = time.time() + self.inflight_wait_timeout
+        if deadline is not None:
+            wait_until = min(wait_until, deadline)
+        while waiting and time.time() < wait_until:
+            time.sleep(0.05)
+            for date in list(waiting):
+                entry = self._shared_cache.get(self._raw_key(date))
+                if entry is not None:
+                    results[date] = entry[0]
+                    waiting.remove(date)
+                elif not self._shared_cache.is_locked(self._raw_key(date) + ":lock"):
+                    # the other process finished without caching: no menu or upstream failed
+                    results[date] = None
+                    waiting.remove(date)
+        for date in waiting:
+            results[date] = None
+        return results
+
+
+    def _refresh_in_background(self, dates: List[str]):
+        ''' Schedules a background refresh of dates that are not already being refreshed '''
+        with self._refreshing_lock:
+            dates = [date for date in dates if date not in self._refreshing]
+            self._refreshing.update(dates)
+        if not dates:
+            return
+        try:
+            self._refresh_executor.submit(self._refresh_raw, dates)
+        except RuntimeError:
+            # executor shut down
+            with self._refreshing_lock:
+                self._refreshing.difference_update(dates)
+
+    def _refresh_raw(self, dates: List[str]):
+        try:
+            self._lead_fetch(dates)
+        except Exception:
+            self.logger.exception(f"Background refresh failed for {dates}")
+        finally:
+            with self._refreshing_lock:
+                self._refreshing.difference_update(dates)
+
+    def _lead_fetch(self, dates: List[str]) -> List[str]:
+        ''' Fetches and caches the dates that are not already in flight elsewhere.
+            Returns the dates this call fetched. '''
+        leading = []
+        for date in dates:
+            _, is_leader = self._join_flight(self._raw_key(date))
+            if is_leader:
+                leading.append(date)
+        fetched: Dict[str, Any] = {}
+        try:
+            if leading:
+                fetched = self._fetch_and_store(leading)
+        finally:
+            for date in leading:
+                self._finish_flight(self._raw_key(date), result=fetched.get(date))
+        return leading
+
 
-    def menu_to_json(self, menu_list, language: str, date: str) -> Dict:
+    def menu_digests(self, dates: List[str]) -> tuple:
+        ''' Returns the payload digest of each date: "empty" if upstream has no menu for it,
+            None if it is not cached (upstream failed or it was never fetched) '''
+        digests = []
+        for date in dates:
+            version = self._raw_cache.peek_version(self._raw_key(date))
+            if version is not None:
+                digests.append(version[0])
+            elif self._negative_cache.peek(self._raw_key(date)) == "empty":
+                digests.append("empty")
+            else:
+                digests.append(None)
+        return tuple(digests)
+
+
+    def cached_body(self, key: str, dates: List[str], versions: tuple, build) -> Dict[str, Any]:
+        """ Returns an encoded response body built from the menus of dates, rendering it
+            with build() only when no body exists for those versions of the menus.
+        Parameters
+        key      - route, format and language of the response
+        dates    - dates whose menus the body is built from
+        versions - the versions fetch_menus_multi returned with those menus; the cache is
+                   keyed on them rather than on what is cached now, which may be newer
+        build    - callable returning the body as str
+        Returns
+        {"body": bytes, "etag": content hash, "last_modified": datetime}
+        """
+        digests = ",".join(digest for digest, _ in versions)
+        cache_key = f"body:{key}:{','.join(dates)}:{digests}"
+        cached = self._body_cache.get(cache_key)
+        if cached is not None:
+            # bodies are keyed by content version, so they stay valid as long as they are used
+            self._body_cache.touch(cache_key, ttl=self.cache_hard_ttl + self.cache_stale_if_error)
+            return cached
+        body = build().encode('utf-8')
+        modified = [modified_at for _, modified_at in versions if modified_at is not None]
+        entry = {
+            "body": body,
+            "etag": hashlib.sha1(body).hexdigest(),
+            "last_modified": datetime.datetime.fromtimestamp(max(modified) if modified else time.time(), datetime.timezone.utc),
+        }
+        # bodies are versioned by their source payloads, so they only need to outlive them
+        self._body_cache.set(cache_key, entry, ttl=self.cache_hard_ttl + self.cache_stale_if_error)
+        return entry
+
+
+    def _raw_key(self, date: str) -> str:
+        return f"raw:{self.site_name}:{self.menu_name}:{date}"
+
+    def _view_key(self, date: str, language: str) -> str:
+        return f"menu:{self.site_name}:{self.menu_name}:{date}:{language}"
+
+    def _view_stale_ttl(self) -> int:
+        # stale views are only reused while their payload digest matches, so they may be
+        # kept as long as a payload itself can be served
+        return max(0, self.cache_hard_ttl - self.cache_ttl) + self.cache_stale_if_error
+
+    @staticmethod
+    def _payload_digest(day_list) -> str:
+        ''' Fingerprint of a raw upstream payload, independent of key order '''
+        encoded = json.dumps(day_list, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+        return hashlib.sha1(encoded.encode("utf-8")).hexdigest()
+
+
+    @staticmethod
+    def _split_menu_by_date(menu_list, dates: List[str]) -> Dict[str, List[Any]]:
+        ''' Splits a multi-date upstream response into one menu_list per date.
+        Days are matched on their date field; if upstream leaves it out, the days are
+        assumed to come back in the requested order (only when every date is present).
+        '''
+        per_date: Dict[str, List[Any]] = {}
+        if not menu_list or not isinstance(menu_list, list):
+            return per_date
+        unmatched = []
+        for day in menu_list:
+            day_date = None
+            if isinstance(day, dict):
+                for field in ("date", "menuDate", "day"):
+                    value = day.get(field)
+                    if isinstance(value, str) and len(value) >= 10:
+                        day_date = value[:10]
+                        break
+            if day_date in dates:
+                per_date.setdefault(day_date, []).append(day)
+            else:
+                unmatched.append(day)
+        if unmatched and not per_date and len(unmatched) == len(dates):
+            for date, day in zip(dates, unmatched):
+                per_date[date] = [day]
+        return per_date
+
+
+    def serving_dates(self, start: str, end: str) -> List[str]:
+        ''' Returns the dates from start to end (YYYY-MM-DD, inclusive) when meals are
+            served, skipping saturdays & sundays. '''
+        date = datetime.date.fromisoformat(start)
+        last = datetime.date.fromisoformat(end)
+        dates = []
+        while date <= last:
+            if date.isoweekday() <= 5:
+                dates.append(date.isoformat())
+            date = date + datetime.timedelta(days=1)
+        return dates
+
+
+    def next_meal_dates(self, count: int) -> List[str]:
+        ''' Returns the next count serving dates, starting from next_meal_date(0). '''
+        return [self.next_meal_date(i) for i in range(0, int(count))]
+
+
+    def menu_to_json(self, menu_list, language: str, date: str, index=None) -> Dict:
         ''' For parsing the menu fetched from poweresta and returning a json dictionary
         Parameters
         menu_list     - list of menu items
         language: str - language (sv, en, fi)
         date:     str - date in format YYYY-MM-DD
+        index         - index_menu(menu_list), to reuse one parse for several languages
         Returns
         {
             "day": "2021-09-01",
@@ -387,98 +1769,92 @@ class APIClient:
             "Extra": "No menu available"    // If no menu available
         }
         '''
-        language = language.lower()
-
-        language_aliases = {
-            'sv': 'sv',
-            'swe': 'sv',
-            'en': 'en',
-            'fi': 'fi',
-            'fin': 'fi'
-        }
-
-        if(language not in language_aliases):
-            language = 'en' # Default to english if language not supported
-        else:
-            language = language_aliases[language]
+        language = self.normalize_language(language)
 
         obj = {}
         obj["day"] = date
-        date = datetime.datetime.strptime(date, "%Y-%m-%d").date()
-        obj["dayName"] = days[language][date.isoweekday()]
-        
+        obj["dayName"] = day_name(date, language)
+
         if not menu_list or len(menu_list) == 0:
-            obj["Extra"] = "No menu available" 
-        else: 
-            i=1 # Tracks number of unnamed meal options
-            menu = menu_list[0] # Here we are only interested in the one (first) day
-            options = menu.get("mealOptions")
-            if options is not None:
-                # For every meal option
-                for meal_option in menu.get("mealOptions"):
-                    # Getting allergens
-                    diet_text = ""
-                    for diet in meal_option.get("rows")[0].get("diets", []):
-                        if diet.get("language") == language:
-                            diets = diet.get("dietShorts", [])
-                            diet_text = f""" ({", ".join(diets)})""" if diets else ""
-                    # Getting option and dish names
+            obj["Extra"] = "No menu available"
+            return obj
+        if index is None:
+            index = self.index_menu(menu_list)
+        if index is None:
+            return obj
+
+        i=1 # Tracks number of unnamed meal options
+        for names, dishes, diets in index:
+            # Getting option and dish names
+            if language in names:
+                option_name = names[language]
+                if option_name is _unnamed:
                     option_name = f"Unnamed meal option {i}"
-                    for name_entry in meal_option.get("names", []):
-                        if name_entry.get("language") == language:
-                            option_name = name_entry.get("name", f"Unnamed meal option {i}")
-                            i = i + 1
-                            break
-                    dish_name = "None"
-                    for name_row in meal_option.get("rows")[0].get("names"):
-                        if name_row.get("language") == language:
-                            dish_name = name_row.get("name", "Unnamed dish")
-                            # Add allergens
-                            dish_name += diet_text
-                    obj[option_name] = dish_name
+                i = i + 1
+            else:
+                option_name = f"Unnamed meal option {i}"
+            dish_name = dishes.get(language, "None")
+            if language in dishes:
+                # Add allergens
+                diet_shorts = diets.get(language)
+                if diet_shorts:
+                    dish_name += f""" ({", ".join(diet_shorts)})"""
+            obj[option_name] = dish_name
         return obj
 
 
-    def next_meal_date(self, days):
-        ''' Returns the next date when a meal is served, skipping saturdays & sundays.'''
-        date = datetime.date.today()
-        d = int(days)
-
-        for i in range(0, d):
-            date = date + datetime.timedelta(days=1)
-            while (date.isoweekday() > 5):
-              date = date + datetime.timedelta(days=1) 
+    @staticmethod
+    def index_menu(menu_list):
+        ''' Indexes the meal options of the first day in menu_list by language in a single pass.
+        Returns a list with one (names, dishes, diets) tuple per meal option, each a dict
+        keyed by language, or None when the day has no mealOptions. Options without rows,
+        names or diets are tolerated.
+        '''
+        menu = menu_list[0] if menu_list else None # Here we are only interested in the one (first) day
+        options = menu.get("mealOptions") if isinstance(menu, dict) else None
+        if options is None:
+            return None
+        index = []
+        for meal_option in options:
+            names = {}
+            for name_entry in meal_option.get("names") or []:
+                # the first name in a language wins
+                language = name_entry.get("language")
+                if language not in names:
+                    names[language] = name_entry.get("name", _unnamed)
+            rows = meal_option.get("rows") or [{}]
+            dishes = {}
+            for name_row in rows[0].get("names") or []:
+                # the last dish name and diet list in a language win
+                dishes[name_row.get("language")] = name_row.get("name", "Unnamed dish")
+            diets = {}
+            for diet in rows[0].get("diets") or []:
+                diets[diet.get("language")] = diet.get("dietShorts", [])
+            index.append((names, dishes, diets))
+        return index
 
-        return date.isoformat()
-    
 
-    def json_menu(self, date, language) -> Dict:
-        ''' Returns json object with menu for a given date '''
-        return self.fetch_menu(date=date, language=language)
+    @staticmethod
+    def normalize_language(language: str) -> str:
+        ''' Maps a requested language or alias to sv, en or fi (default english) '''
+        return language_aliases.get(str(language).lower(), 'en')
 
 
-    def textAndMeals(self, date, language):
-        ''' Returns menu for a given date in text format '''
-        menu = self.fetch_menu(date=date, language=language)
-        if not isinstance(menu, dict):
-            # Log the unexpected payload for diagnostics and return a friendly message
-            try:
-                self.logger.error(f"textAndMeals: unexpected menu payload for date={date}, language={language}: {menu!r}")
-            except Exception:
-                pass
-            return Response("No menu available", mimetype='text/plain; charset=utf-8')
+    def next_meal_date(self, days):
+        ''' Returns the next date when a meal is served, skipping saturdays & sundays.'''
+        with self.tracer.span("dates"):
+            date = datetime.date.today()
+            d = int(days)
 
-        # Work on a shallow copy to avoid mutating the cached object
-        safe_menu = dict(menu)
-        safe_menu.pop("day", None)
-        safe_menu.pop("dayName", None)
+            for i in range(0, d):
+                date = date + datetime.timedelta(days=1)
+                while (date.isoweekday() > 5):
+                  date = date + datetime.timedelta(days=1) 
 
-        output = ""
-        if len(safe_menu) == 0:
-            output = "No menu available"
-        else:
-            for key, value in safe_menu.items():
-                output += f"{key}: {value}\r\n"
-        return Response(output, mimetype='text/plain; charset=utf-8')
+            return date.isoformat()
     
 
+    def menu_text(self, menu) -> str:
+        ''' Formats a menu from menu_to_json as plain text '''
+        output = "".join(f"{key}: {value}\r\n" for key, value in menu.items() if key not in ("day", "dayName"))
+        return output or "No menu available"
@@ -0,0 +1,120 @@
+""" Micro-benchmark of APIClient.menu_to_json against the previous linear-scan parser.
+
+Usage: python bench/bench_menu_to_json.py [payload.json ...]
+
+Payloads are responses of public/publicmenu/dates/{site} (a list of days), e.g. recorded
+with curl. bench/payloads/*.json is used by default: a synthetic week with the shape of an
+upstream response (placeholder dish names and ingredients), not a recording, so record a
+real response to measure real menus. Each day is parsed in every language with both
+implementations, the outputs are compared and the timings reported.
+"""
+import datetime
+import glob
+import json
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from app.utils import APIClient, days  # noqa: E402
+
+LANGUAGES = ("sv", "en", "fi")
+
+
+def legacy_menu_to_json(menu_list, language, date):
+    ''' menu_to_json as it was before the index-based parser '''
+    language = language.lower()
+    language_aliases = {'sv': 'sv', 'swe': 'sv', 'en': 'en', 'fi': 'fi', 'fin': 'fi'}
+    if(language not in language_aliases):
+        language = 'en'
+    else:
+        language = language_aliases[language]
+    obj = {}
+    obj["day"] = date
+    date = datetime.datetime.strptime(date, "%Y-%m-%d").date()
+    obj["dayName"] = days[language][date.isoweekday()]
+    if not menu_list or len(menu_list) == 0:
+        obj["Extra"] = "No menu available"
+    else:
+        i = 1
+        menu = menu_list[0]
+        options = menu.get("mealOptions")
+        if options is not None:
+            for meal_option in menu.get("mealOptions"):
+                diet_text = ""
+                for diet in meal_option.get("rows")[0].get("diets", []):
+                    if diet.get("language") == language:
+                        diets = diet.get("dietShorts", [])
+                        diet_text = f""" ({", ".join(diets)})""" if diets else ""
+                option_name = f"Unnamed meal option {i}"
+                for name_entry in meal_option.get("names", []):
+                    if name_entry.get("language") == language:
+                        option_name = name_entry.get("name", f"Unnamed meal option {i}")
+                        i = i + 1
+                        break
+                dish_name = "None"
+                for name_row in meal_option.get("rows")[0].get("names"):
+                    if name_row.get("language") == language:
+                        dish_name = name_row.get("name", "Unnamed dish")
+                        dish_name += diet_text
+                obj[option_name] = dish_name
+    return obj
+
+
+def load_days(paths):
+    for path in paths:
+        with open(path, encoding="utf-8") as f:
+            for day in json.load(f):
+                date = str(day.get("date", "2025-01-01"))[:10]
+                yield os.path.basename(path), date, [day]
+
+
+def main():
+    paths = sys.argv[1:] or sorted(glob.glob(os.path.join(os.path.dirname(__file__), "payloads", "*.json")))
+    client = APIClient.__new__(APIClient)  # the parser needs no configuration or threads
+    comparable, legacy_failures = [], 0
+    for name, date, menu_list in load_days(paths):
+        try:
+            expected = [legacy_menu_to_json(menu_list, language, date) for language in LANGUAGES]
+        except (IndexError, TypeError, AttributeError):
+            # the old parser crashes on options without rows; only the new one is timed there
+            legacy_failures += 1
+            continue
+        actual = [client.menu_to_json(menu_list, language, date) for language in LANGUAGES]
+        if actual != expected:
+            print(f"MISMATCH in {name} {date}:\n  legacy: {expected}\n  new:    {actual}")
+            sys.exit(1)
+        comparable.append((date, menu_list))
+
+    if not comparable:
+        print("No payload days both parsers can handle")
+        sys.exit(1)
+
+    def run_legacy():
+        for date, menu_list in comparable:
+            for language in LANGUAGES:
+                legacy_menu_to_json(menu_list, language, date)
+
+    def run_new():
+        for date, menu_list in comparable:
+            for language in LANGUAGES:
+                client.menu_to_json(menu_list, language, date)
+
+    def run_new_shared_index():
+        for date, menu_list in comparable:
+            index = client.index_menu(menu_list)
+            for language in LANGUAGES:
+                client.menu_to_json(menu_list, language, date, index=index)
+
+    number = 200
+    parses = number * len(comparable) * len(LANGUAGES)
+    print(f"{len(comparable)} days x {len(LANGUAGES)} languages, outputs identical "
+          f"({legacy_failures} days only the new parser handles)")
+    for label, fn in (("legacy", run_legacy), ("index", run_new), ("index, shared across languages", run_new_shared_index)):
+        best = min(timeit.repeat(fn, number=number, repeat=5))
+        print(f"{label:32s} {best / parses * 1e6:8.2f} us/parse")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,225 @@
+""" Local stand-in for the Poweresta public API, for load tests and benchmarks.
+
+Usage: python bench/fake_poweresta.py [--port 8765] [--latency 0.05] [options] [payload.json ...]
+
+Implements POST /login and GET /public/publicmenu/dates/{site}?dates=...&menu=... .
+Menus are replayed from upstream payloads (default bench/payloads/*.json, a synthetic
+week): each requested date gets the payload day with the same weekday, with its date rewritten, so
+any date range has menus. Wednesdays can be left empty with --empty-weekdays 3, or the Nth
+serving day from today (counted like the app's /N/ routes) with --empty-serving-days N.
+With --weekend-menus saturdays and sundays get menus too, so a load test run on a weekend
+sees the same menus relative to today as one run on a weekday.
+
+Failure modes, all optional:
+  --token-ttl S         tokens are rejected with 403 S seconds after login
+  --throttle-every N    every Nth menu request gets 429 with Retry-After: --retry-after
+  --throttle-first N    the first N menu requests get 429 (deterministic, for baselines)
+  --outage START:LENGTH menu requests get 503 from START to START+LENGTH seconds after startup
+
+Counters are served at GET /_stats and reset with POST /_reset; POST /_outage?seconds=N
+starts an outage right away.
+"""
+import argparse
+import datetime
+import glob
+import json
+import os
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+MENU_PATH = "/public/publicmenu/dates/"
+
+
+def serving_day(n):
+    ''' The date of the app's /n/ route: today, then n serving days (monday to friday) on '''
+    date = datetime.date.today()
+    for _ in range(n):
+        date += datetime.timedelta(days=1)
+        while date.isoweekday() > 5:
+            date += datetime.timedelta(days=1)
+    return date.isoformat()
+
+
+def load_payloads(paths):
+    ''' Returns {isoweekday: day} from the payloads; later files win '''
+    by_weekday = {}
+    for path in paths:
+        with open(path, encoding="utf-8") as f:
+            for day in json.load(f):
+                date = datetime.date.fromisoformat(str(day.get("date", ""))[:10])
+                by_weekday[date.isoweekday()] = day
+    return by_weekday
+
+
+class FakePoweresta:
+    def __init__(self, payloads, latency=0.0, jitter=0.0, token_ttl=0.0, throttle_every=0,
+                 throttle_first=0, retry_after=1, outage=None, empty_weekdays=(), empty_serving_days=(),
+                 weekend_menus=False):
+        self.payloads = payloads
+        self.latency = latency
+        self.jitter = jitter
+        self.token_ttl = token_ttl
+        self.throttle_every = throttle_every
+        self.throttle_first = throttle_first
+        self.retry_after = retry_after
+        self.empty_weekdays = set(empty_weekdays)
+        self.empty_serving_days = set(empty_serving_days)
+        self.weekend_menus = weekend_menus
+        self.started = time.time()
+        self.outage = (self.started + outage[0], self.started + outage[0] + outage[1]) if outage else None
+        self.tokens = {}
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.stats = {'logins': 0, 'menu_requests': 0, 'menu_dates': 0, 'forbidden': 0,
+                          'throttled': 0, 'unavailable': 0, 'max_concurrency': 0}
+            self._concurrency = 0
+
+    def count(self, stat, n=1):
+        with self.lock:
+            self.stats[stat] += n
+
+    def login(self):
+        token = uuid.uuid4().hex
+        with self.lock:
+            self.tokens[token] = time.time()
+            self.stats['logins'] += 1
+        return token
+
+    def token_valid(self, token):
+        with self.lock:
+            issued = self.tokens.get(token)
+        return issued is not None and (not self.token_ttl or time.time() - issued < self.token_ttl)
+
+    def menu(self, dates):
+        ''' Returns (status, headers, body) for a menu request '''
+        with self.lock:
+            self.stats['menu_requests'] += 1
+            self.stats['menu_dates'] += len(dates)
+            n = self.stats['menu_requests']
+            self._concurrency += 1
+            self.stats['max_concurrency'] = max(self.stats['max_concurrency'], self._concurrency)
+        try:
+            if self.latency or self.jitter:
+                time.sleep(self.latency + random.uniform(0, self.jitter))
+            now = time.time()
+            if self.outage and self.outage[0] <= now < self.outage[1]:
+                self.count('unavailable')
+                return 503, {}, {"error": "unavailable"}
+            if n <= self.throttle_first or (self.throttle_every and n % self.throttle_every == 0):
+                self.count('throttled')
+                return 429, {"Retry-After": str(self.retry_after)}, {"error": "throttled"}
+            days = []
+            empty_dates = {serving_day(n) for n in self.empty_serving_days}
+            for date in dates:
+                weekday = datetime.date.fromisoformat(date).isoweekday()
+                if self.weekend_menus and weekday > 5:
+                    weekday -= 5
+                day = self.payloads.get(weekday)
+                if day is None or weekday in self.empty_weekdays or date in empty_dates:
+                    continue
+                day = dict(day)
+                day["date"] = f"{date}T00:00:00"
+                days.append(day)
+            return 200, {}, days
+        finally:
+            with self.lock:
+                self._concurrency -= 1
+
+
+def make_handler(fake):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def _send(self, status, body, headers=None):
+            data = json.dumps(body).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length", 0))
+            self.rfile.read(length)
+            url = urlparse(self.path)
+            if url.path == "/login":
+                return self._send(200, {"token": fake.login()})
+            if url.path == "/_reset":
+                fake.reset()
+                return self._send(200, {})
+            if url.path == "/_outage":
+                seconds = float(parse_qs(url.query).get("seconds", ["10"])[0])
+                fake.outage = (time.time(), time.time() + seconds)
+                return self._send(200, {})
+            self._send(404, {})
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            if url.path == "/_stats":
+                with fake.lock:
+                    return self._send(200, dict(fake.stats))
+            if not url.path.startswith(MENU_PATH):
+                return self._send(404, {})
+            if not fake.token_valid(self.headers.get("authorization")):
+                fake.count('forbidden')
+                return self._send(403, {"error": "forbidden"})
+            dates = [d for d in parse_qs(url.query).get("dates", [""])[0].split(",") if d]
+            status, headers, body = fake.menu(dates)
+            self._send(status, body, headers)
+
+    return Handler
+
+
+def serve(fake, port):
+    server = ThreadingHTTPServer(("127.0.0.1", port), make_handler(fake))
+    server.daemon_threads = True
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("payloads", nargs="*")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every menu request")
+    parser.add_argument("--jitter", type=float, default=0.0, help="random extra latency, up to this many seconds")
+    parser.add_argument("--token-ttl", type=float, default=0.0)
+    parser.add_argument("--throttle-every", type=int, default=0)
+    parser.add_argument("--throttle-first", type=int, default=0)
+    parser.add_argument("--retry-after", type=int, default=1)
+    parser.add_argument("--outage", default=None, help="START:LENGTH in seconds after startup")
+    parser.add_argument("--empty-weekdays", default="", help="comma separated isoweekdays without a menu")
+    parser.add_argument("--empty-serving-days", default="", help="comma separated serving days from today (0 = today) without a menu")
+    parser.add_argument("--weekend-menus", action="store_true", help="serve menus on saturdays and sundays too")
+    args = parser.parse_args()
+
+    paths = args.payloads or sorted(glob.glob(os.path.join(os.path.dirname(__file__), "payloads", "*.json")))
+    outage = tuple(float(x) for x in args.outage.split(":")) if args.outage else None
+    fake = FakePoweresta(
+        load_payloads(paths), latency=args.latency, jitter=args.jitter, token_ttl=args.token_ttl,
+        throttle_every=args.throttle_every, throttle_first=args.throttle_first, retry_after=args.retry_after, outage=outage,
+        empty_weekdays=[int(d) for d in args.empty_weekdays.split(",") if d],
+        empty_serving_days=[int(d) for d in args.empty_serving_days.split(",") if d],
+        weekend_menus=args.weekend_menus,
+    )
+    server = serve(fake, args.port)
+    print(f"Fake Poweresta listening on http://127.0.0.1:{args.port}", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,263 @@
+""" Load test of the API against a local fake Poweresta (bench/fake_poweresta.py).
+
+Usage: python bench/load_test.py [--scenario steady ...] [--requests 2000] [--concurrency 16]
+                                 [--save-baseline bench/baseline.json | --baseline bench/baseline.json]
+
+Every scenario starts a fresh fake upstream and a fresh gunicorn (gunicorn.conf.py) pointed
+at it, so caches start cold and runs are comparable. Concurrent clients then request a fixed,
+seeded mix of the today, days, week, date and bulk routes in text, json and html, and the
+run reports throughput, p50/p99 latency, upstream logins and menu calls and the cache hit
+ratio (from /taffa/metrics, counting dates answered from parsed views as hits).
+
+Results must not depend on the day the test runs: the date route is a serving day relative
+to today, the fake upstream serves weekend menus and its empty day is a serving day relative
+to today, so every run requests the same days with the same menus relative to today.
+
+With --baseline the run fails (exit status 1) when the cache hit ratio drops or upstream
+menu calls per request grow beyond the tolerances compared to a saved baseline, so cache
+and fanout regressions are caught before deploy. Throughput and latency are reported but
+not checked as they depend on the machine; for the same reason upstream calls are only
+checked in scenarios whose cache does not expire during the run (the others expire it
+every second, so their call count follows the run time).
+
+The app reads its settings from the environment; a .env in the repository root would
+override the fake upstream, so the test refuses to run with one.
+"""
+import argparse
+import datetime
+import json
+import os
+import random
+import re
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+import requests
+
+from fake_poweresta import serving_day
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+# name -> (fake upstream options, app environment, action after warm-up)
+SCENARIOS = {
+    "steady": (["--latency", "0.05", "--jitter", "0.02", "--empty-serving-days", "2"], {}, None),
+    "token-expiry": (["--latency", "0.05", "--token-ttl", "1"],
+                     {"MENU_CACHE_TTL_SECONDS": "1", "MENU_CACHE_HARD_TTL_SECONDS": "2"}, None),
+    # periodic 429s on top of second-long TTLs make the results depend on timing; throttling
+    # the cold start instead is reproducible
+    "throttled": (["--latency", "0.05", "--throttle-first", "2", "--retry-after", "1"], {}, None),
+    "outage": (["--latency", "0.05"],
+               {"MENU_CACHE_TTL_SECONDS": "1", "MENU_CACHE_HARD_TTL_SECONDS": "2"}, "outage"),
+}
+
+# relative to the baseline: hit ratio may drop by this much, upstream calls per request grow by this factor
+HIT_RATIO_TOLERANCE = 0.02
+UPSTREAM_TOLERANCE = 1.10
+
+
+def routes():
+    ''' The request mix: every language and format of the main routes '''
+    date = datetime.date.fromisoformat(serving_day(2))
+    paths = []
+    for language in ("sv", "en", "fi"):
+        for prefix in ("", "json/", "html/"):
+            for route in ("today/", "1/", "3/", "week/", f"{date.day}/{date.month}/{date.year}/"):
+                paths.append(f"/taffa/{language}/{prefix}{route}")
+    paths.append("/taffa/bulk/")
+    paths.append("/taffa/bulk/?format=text&days=3")
+    return paths
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def wait_for(url, timeout=20):
+    end = time.time() + timeout
+    while time.time() < end:
+        try:
+            requests.get(url, timeout=1)
+            return
+        except requests.RequestException:
+            time.sleep(0.1)
+    raise RuntimeError(f"{url} did not come up in {timeout}s")
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+
+def cache_lookups(base_url):
+    ''' Returns {result: count} of dagsen_cache_lookups_total '''
+    text = requests.get(f"{base_url}/taffa/metrics", timeout=5).text
+    return {m.group(1): float(m.group(2)) for m in re.finditer(r'^dagsen_cache_lookups_total\{result="([^"]+)"\} (\S+)$', text, re.M)}
+
+
+def drive(base_url, paths, total, concurrency, seed):
+    ''' Sends total requests from concurrency clients; returns (latencies, errors, elapsed) '''
+    latencies, errors = [], []
+    lock = threading.Lock()
+    per_client = [total // concurrency + (1 if i < total % concurrency else 0) for i in range(concurrency)]
+
+    def client(i):
+        rng = random.Random(seed + i)
+        session = requests.Session()
+        own = []
+        for _ in range(per_client[i]):
+            url = base_url + rng.choice(paths)
+            start = time.perf_counter()
+            try:
+                status = session.get(url, timeout=30).status_code
+            except requests.RequestException as e:
+                status = type(e).__name__
+            own.append(time.perf_counter() - start)
+            if status != 200:
+                with lock:
+                    errors.append(status)
+        with lock:
+            latencies.extend(own)
+
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(concurrency)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return latencies, errors, time.perf_counter() - start
+
+
+def run_scenario(name, args):
+    fake_args, app_env, action = SCENARIOS[name]
+    upstream_port, app_port = free_port(), free_port()
+    upstream_url, base_url = f"http://127.0.0.1:{upstream_port}", f"http://127.0.0.1:{app_port}"
+    env = dict(os.environ)
+    env.update({
+        "API_BASE_URL": upstream_url, "SITE_NAME": "bench", "MENU_NAME": "lunch",
+        "API_USERNAME": "bench", "API_PASSWORD": "bench", "PORT": str(app_port),
+        "WEB_WORKERS": str(args.workers), "WEB_WORKER_CLASS": args.worker_class,
+        "REQUEST_DEADLINE_SECONDS": "10", "METRICS_FLUSH_SECONDS": "0.2",
+    })
+    env.update(app_env)
+    procs = []
+    try:
+        procs.append(subprocess.Popen([sys.executable, os.path.join(ROOT, "bench", "fake_poweresta.py"),
+                                       "--port", str(upstream_port), "--weekend-menus"] + fake_args,
+                                      stdout=subprocess.DEVNULL))
+        wait_for(f"{upstream_url}/_stats")
+        procs.append(subprocess.Popen([sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", "run:app"],
+                                      cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL))
+        wait_for(f"{base_url}/taffa/stats")
+        paths = routes()
+
+        # runs start from a cold cache, except for the outage, which needs something cached
+        # to fall back on: warm up, let it go stale and take upstream down
+        lookups_before = {}
+        if action == "outage":
+            drive(base_url, paths, max(args.concurrency, args.requests // 10), args.concurrency, args.seed + 10000)
+            time.sleep(0.5)
+            lookups_before = cache_lookups(base_url)
+            requests.post(f"{upstream_url}/_reset", timeout=5)
+            time.sleep(2)
+            requests.post(f"{upstream_url}/_outage?seconds=60", timeout=5)
+
+        latencies, errors, elapsed = drive(base_url, paths, args.requests, args.concurrency, args.seed)
+        # let every worker flush its metrics
+        time.sleep(0.5)
+        upstream = requests.get(f"{upstream_url}/_stats", timeout=5).json()
+        lookups = cache_lookups(base_url)
+    finally:
+        for proc in reversed(procs):
+            proc.terminate()
+            try:
+                proc.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+
+    delta = {k: v - lookups_before.get(k, 0) for k, v in lookups.items()}
+    # every lookup but a miss was answered from cache (parsed views, raw payloads or negative entries)
+    total_lookups = sum(delta.values())
+    hits = total_lookups - delta.get("miss", 0)
+    return {
+        "requests": len(latencies),
+        "errors": len(errors),
+        "error_kinds": sorted({str(e) for e in errors}),
+        "throughput_rps": round(len(latencies) / elapsed, 1),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+        "upstream_logins": upstream["logins"],
+        "upstream_menu_calls": upstream["menu_requests"],
+        "upstream_menu_dates": upstream["menu_dates"],
+        "upstream_max_concurrency": upstream["max_concurrency"],
+        "upstream_calls_per_1k_requests": round(upstream["menu_requests"] * 1000 / max(1, len(latencies)), 2),
+        "cache_hit_ratio": round(hits / total_lookups, 4) if total_lookups else None,
+    }
+
+
+def check(name, result, baseline):
+    ''' Returns the regressions of result against the baseline of the scenario '''
+    problems = []
+    base = baseline.get(name)
+    if base is None:
+        return problems
+    if base["cache_hit_ratio"] is not None and result["cache_hit_ratio"] is not None \
+            and result["cache_hit_ratio"] < base["cache_hit_ratio"] - HIT_RATIO_TOLERANCE:
+        problems.append(f"cache hit ratio {result['cache_hit_ratio']} < baseline {base['cache_hit_ratio']}")
+    allowed = base["upstream_calls_per_1k_requests"] * UPSTREAM_TOLERANCE + 1
+    if "MENU_CACHE_TTL_SECONDS" not in SCENARIOS[name][1] and result["upstream_calls_per_1k_requests"] > allowed:
+        problems.append(f"upstream calls per 1k requests {result['upstream_calls_per_1k_requests']} > {allowed:.2f}")
+    # a stray timeout on a loaded machine is not a regression
+    if result["errors"] > base["errors"] + result["requests"] // 1000:
+        problems.append(f"{result['errors']} errors, baseline {base['errors']}")
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--scenario", action="append", choices=sorted(SCENARIOS), help="default: all")
+    parser.add_argument("--requests", type=int, default=2000, help="requests per scenario")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--workers", type=int, default=1, help="gunicorn workers; metrics are summed over them")
+    parser.add_argument("--worker-class", default="gthread", choices=("gthread", "gevent"))
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--baseline", help="fail on regressions against this file")
+    parser.add_argument("--save-baseline", help="write the results to this file")
+    args = parser.parse_args()
+
+    if os.path.exists(os.path.join(ROOT, ".env")):
+        print("A .env in the repository root would override the fake upstream settings; move it away first")
+        sys.exit(2)
+
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+
+    results, failed = {}, False
+    for name in args.scenario or list(SCENARIOS):
+        result = results[name] = run_scenario(name, args)
+        print(f"{name:13s} {result['requests']} requests, {result['errors']} errors {result['error_kinds'] or ''}\n"
+              f"{'':13s} {result['throughput_rps']} req/s, p50 {result['p50_ms']} ms, p99 {result['p99_ms']} ms\n"
+              f"{'':13s} upstream: {result['upstream_logins']} logins, {result['upstream_menu_calls']} menu calls "
+              f"for {result['upstream_menu_dates']} dates (max {result['upstream_max_concurrency']} concurrent), "
+              f"cache hit ratio {result['cache_hit_ratio']}", flush=True)
+        for problem in check(name, result, baseline):
+            print(f"{'':13s} REGRESSION: {problem}")
+            failed = True
+
+    if args.save_baseline:
+        with open(args.save_baseline, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+            f.write("\n")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
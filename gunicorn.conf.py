@@ -0,0 +1,82 @@
+# Production server settings, used by: gunicorn -c gunicorn.conf.py run:app
+import glob
+import os
+import shutil
+import tempfile
+
+if os.getenv("WEB_WORKER_CLASS", "gthread") == "gevent":
+    # Patch before the app (requests, ssl, threading) is imported by preload_app
+    from gevent import monkey
+    monkey.patch_all()
+
+from dotenv import load_dotenv
+
+load_dotenv(override=True)
+
+
+def _env_int(name, default):
+    try:
+        return int(os.getenv(name, default))
+    except ValueError:
+        return int(default)
+
+
+bind = f"0.0.0.0:{os.getenv('PORT', '5000')}"
+# gthread: one thread per in-flight request. gevent: cooperative workers that keep up to
+# worker_connections requests open each, so slow upstream calls and backoff sleeps do not
+# tie up a thread (requests, time.sleep and threading are monkey patched by gunicorn).
+worker_class = os.getenv("WEB_WORKER_CLASS", "gthread")
+workers = _env_int("WEB_WORKERS", "2")
+threads = _env_int("WEB_THREADS", "8")
+worker_connections = _env_int("WEB_WORKER_CONNECTIONS", "500")
+keepalive = _env_int("WEB_KEEPALIVE", "5")
+backlog = _env_int("WEB_BACKLOG", "2048")
+timeout = _env_int("WEB_TIMEOUT", "30")
+graceful_timeout = _env_int("WEB_GRACEFUL_TIMEOUT", "30")
+# Load the app (and restore the cache snapshot) once in the master before forking workers
+preload_app = os.getenv("WEB_PRELOAD", "1").lower() in ("1", "true", "yes")
+
+# Every worker thread may call upstream, so size the connection pool to match
+os.environ.setdefault("UPSTREAM_POOL_SIZE", str(threads))
+
+# A scrape of /taffa/metrics lands on any one worker; the workers share their metrics
+# through this directory so every scrape reports the totals of all of them. Files left by
+# an earlier run would be counted as live workers, so the directory starts empty.
+_metrics_dir_created = not os.getenv("METRICS_DIR")
+if _metrics_dir_created:
+    os.environ["METRICS_DIR"] = tempfile.mkdtemp(prefix="dagsen-metrics-")
+else:
+    os.makedirs(os.environ["METRICS_DIR"], exist_ok=True)
+    for path in glob.glob(os.path.join(os.environ["METRICS_DIR"], "*.json")):
+        os.remove(path)
+
+
+def when_ready(server):
+    # The master only forks workers; stop the clients' background threads there
+    if preload_app:
+        from app.routes import registry
+        registry.close()
+
+
+def post_fork(server, worker):
+    # Sessions, locks and background threads must not be shared with the master
+    if preload_app:
+        from app.routes import registry
+        registry.after_fork()
+
+
+def worker_exit(server, worker):
+    # Last flush, so the counts since the previous one are not lost
+    from app.routes import registry
+    registry.primary.metrics.flush()
+
+
+def child_exit(server, worker):
+    # Keep the exited worker's counters in the totals, drop its gauges
+    from app.metrics import mark_process_dead
+    mark_process_dead(os.environ["METRICS_DIR"], worker.pid)
+
+
+def on_exit(server):
+    if _metrics_dir_created:
+        shutil.rmtree(os.environ["METRICS_DIR"], ignore_errors=True)
@@ -0,0 +1,34 @@
+import pytest
+
+from app import utils
+
+
+class FakeClock:
+    ''' Stands in for the time module of app.utils; only moves when advanced '''
+    def __init__(self, now: float = 1_000_000.0):
+        self.now = now
+
+    def time(self) -> float:
+        return self.now
+
+    def advance(self, seconds: float):
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeClock()
+    monkeypatch.setattr(utils.time, "time", fake.time)
+    return fake
+
+
+@pytest.fixture
+def client(monkeypatch):
+    # no upstream, no background threads; tests replace the fetch they exercise
+    for name in ("MENU_CACHE_BACKEND", "MENU_SNAPSHOT_PATH", "METRICS_DIR", "SITES_CONFIG"):
+        monkeypatch.delenv(name, raising=False)
+    monkeypatch.setenv("MENU_PREFETCH_DAYS", "0")
+    monkeypatch.setenv("MENU_CACHE_SWEEP_SECONDS", "0")
+    api_client = utils.APIClient(site={"id": "test"})
+    yield api_client
+    api_client.close()
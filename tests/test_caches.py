@@ -0,0 +1,112 @@
+import os
+import stat
+
+import pytest
+
+from app.sqlite_cache import SQLiteCache
+from app.utils import TTLCache
+
+
+@pytest.fixture
+def sqlite_cache(tmp_path):
+    return SQLiteCache(str(tmp_path / "cache.sqlite3"), max_entries=3)
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def cache(request, tmp_path):
+    if request.param == "memory":
+        return TTLCache(max_entries=3)
+    return SQLiteCache(str(tmp_path / "cache.sqlite3"), max_entries=3)
+
+
+def test_fresh_stale_and_expired(cache, clock):
+    cache.set("key", [1], ttl=10, stale_ttl=5)
+    assert cache.get("key") == [1]
+    clock.advance(11)
+    assert cache.get("key") is None
+    assert cache.get_entry("key") == ([1], clock.now - 1)
+    assert cache.peek("key") == [1]
+    clock.advance(5)
+    assert cache.get_entry("key") is None
+    assert cache.peek("key") is None
+
+
+def test_touch_extends_unexpired_entries_only(cache, clock):
+    cache.set("key", [1], ttl=10, version=["digest", 1])
+    clock.advance(9)
+    assert cache.touch("key", ttl=10)
+    clock.advance(9)
+    assert cache.get("key") == [1]
+    assert tuple(cache.peek_version("key")) == ("digest", 1)
+    clock.advance(2)
+    assert not cache.touch("key", ttl=10)
+
+
+def test_peek_version(cache, clock):
+    cache.set("key", [1], ttl=10, version=("digest", 1))
+    cache.set("plain", [2], ttl=10)
+    assert tuple(cache.peek_version("key")) == ("digest", 1)
+    assert cache.peek_version("plain") is None
+    assert cache.peek_version("missing") is None
+    clock.advance(11)
+    assert cache.peek_version("key") is None
+
+
+def test_entry_budget(cache):
+    for i in range(4):
+        cache.set(f"key{i}", [i], ttl=10 + i)
+    assert cache.stats()['entries'] == 3
+    assert cache.stats()['evictions'] == 1
+    assert cache.peek("key0") is None
+
+
+def test_ttl_cache_evicts_least_recently_used():
+    cache = TTLCache(max_entries=2)
+    cache.set("a", [1])
+    cache.set("b", [2])
+    cache.get("a")
+    cache.set("c", [3])
+    assert cache.peek("a") == [1]
+    assert cache.peek("b") is None
+
+
+def test_ttl_cache_byte_budget():
+    cache = TTLCache(max_entries=10, max_bytes=100)
+    cache.set("a", "x" * 60)
+    cache.set("b", "y" * 60)
+    assert cache.peek("a") is None
+    assert cache.stats()['bytes'] <= 100
+
+
+def test_lock_has_one_owner_per_host(tmp_path):
+    path = str(tmp_path / "cache.sqlite3")
+    # two workers on the same file
+    first, second = SQLiteCache(path), SQLiteCache(path)
+    assert first.acquire_lock("key", ttl=30)
+    assert not second.acquire_lock("key", ttl=30)
+    assert not first.acquire_lock("key", ttl=30)
+    assert second.is_locked("key")
+    # only the owner can release it
+    second.release_lock("key")
+    assert first.is_locked("key")
+    first.release_lock("key")
+    assert second.acquire_lock("key", ttl=30)
+
+
+def test_expired_lock_is_taken_over(tmp_path, clock):
+    path = str(tmp_path / "cache.sqlite3")
+    first, second = SQLiteCache(path), SQLiteCache(path)
+    assert first.acquire_lock("key", ttl=5)
+    clock.advance(6)
+    assert not first.is_locked("key")
+    assert second.acquire_lock("key", ttl=5)
+
+
+def test_secrets_are_private_and_never_evicted(sqlite_cache, clock):
+    sqlite_cache.set_secret("token", ["abc", 1], ttl=60)
+    for i in range(10):
+        sqlite_cache.set(f"key{i}", [i])
+    assert sqlite_cache.get_secret("token") == ["abc", 1]
+    assert stat.S_IMODE(os.stat(sqlite_cache.path).st_mode) == 0o600
+    clock.advance(61)
+    assert sqlite_cache.get_secret("token") is None
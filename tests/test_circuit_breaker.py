@@ -0,0 +1,94 @@
+from app.utils import CircuitBreaker
+
+
+def make_breaker():
+    return CircuitBreaker(failure_rate=0.5, min_calls=4, window_seconds=30, open_seconds=10)
+
+
+def fail(breaker, n):
+    for _ in range(n):
+        assert breaker.allow()
+        breaker.record_failure()
+
+
+def test_stays_closed_below_min_calls(clock):
+    breaker = make_breaker()
+    fail(breaker, 3)
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert breaker.allow()
+
+
+def test_stays_closed_below_failure_rate(clock):
+    breaker = make_breaker()
+    for _ in range(3):
+        breaker.record_success()
+    fail(breaker, 2)
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+def test_old_calls_leave_the_window(clock):
+    breaker = make_breaker()
+    fail(breaker, 3)
+    clock.advance(31)
+    fail(breaker, 1)
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+def test_opens_and_rejects_until_open_seconds_passed(clock):
+    breaker = make_breaker()
+    fail(breaker, 4)
+    assert breaker.state == CircuitBreaker.OPEN
+    assert not breaker.allow()
+    clock.advance(9.9)
+    assert not breaker.allow()
+    assert breaker.stats()['rejected'] == 2
+
+
+def test_half_open_allows_a_single_trial(clock):
+    breaker = make_breaker()
+    fail(breaker, 4)
+    clock.advance(10)
+    assert breaker.allow()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    # the trial has not reported back yet
+    assert not breaker.allow()
+
+
+def test_successful_trial_closes(clock):
+    breaker = make_breaker()
+    fail(breaker, 4)
+    clock.advance(10)
+    assert breaker.allow()
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert breaker.allow()
+    # the failures from before the trial no longer count
+    fail(breaker, 2)
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+def test_failed_trial_opens_again(clock):
+    breaker = make_breaker()
+    fail(breaker, 4)
+    clock.advance(10)
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    assert not breaker.allow()
+    clock.advance(10)
+    assert breaker.allow()
+    assert breaker.stats()['opened'] == 2
+
+
+def test_trial_that_never_reports_back_is_given_up_on(clock):
+    breaker = make_breaker()
+    fail(breaker, 4)
+    clock.advance(10)
+    assert breaker.allow()
+    clock.advance(9.9)
+    assert not breaker.allow()
+    clock.advance(0.1)
+    # a new trial replaces the lost one, and still only one at a time
+    assert breaker.allow()
+    assert not breaker.allow()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
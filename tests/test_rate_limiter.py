@@ -0,0 +1,75 @@
+import threading
+import time
+
+from app.utils import AdaptiveRateLimiter
+
+
+def test_burst_up_to_capacity_then_refill(clock):
+    limiter = AdaptiveRateLimiter(rate=3)
+    assert [limiter.allow() for _ in range(4)] == [True, True, True, False]
+    clock.advance(1 / 3)
+    assert limiter.allow()
+    assert not limiter.allow()
+
+
+def test_timeout_counts_the_callers_already_waiting(clock):
+    limiter = AdaptiveRateLimiter(rate=2)
+    assert limiter.allow() and limiter.allow()
+    # the next token is due in 0.5 s
+    assert not limiter.acquire(timeout=0.4)
+    limiter._stats['queue_depth'] = 2
+    # two callers are ahead of this one, so its token is due in 1.5 s
+    assert not limiter.acquire(timeout=1.4)
+    assert limiter.stats()['timeouts'] == 2
+    assert limiter.stats()['acquired'] == 2
+
+
+def test_throttling_pauses_and_halves_the_rate(clock):
+    limiter = AdaptiveRateLimiter(rate=4, min_rate=1)
+    limiter.on_throttled(pause=5)
+    assert limiter.rate == 2
+    assert not limiter.allow()
+    assert not limiter.acquire(timeout=5)
+    clock.advance(5)
+    assert not limiter.allow()
+    clock.advance(0.5)
+    assert limiter.allow()
+
+
+def test_rate_recovers_additively_up_to_max(clock):
+    limiter = AdaptiveRateLimiter(rate=2, min_rate=0.5, increase=0.5)
+    limiter.on_throttled()
+    limiter.on_throttled()
+    assert limiter.rate == 0.5
+    for _ in range(5):
+        limiter.on_success()
+    assert limiter.rate == 2
+
+
+def test_acquire_waits_for_the_next_token():
+    limiter = AdaptiveRateLimiter(rate=10)
+    for _ in range(10):
+        assert limiter.acquire()
+    t0 = time.time()
+    assert limiter.acquire(timeout=1)
+    assert 0.05 <= time.time() - t0 < 0.5
+
+
+def test_pause_holds_back_callers_already_waiting():
+    limiter = AdaptiveRateLimiter(rate=5)
+    for _ in range(5):
+        assert limiter.acquire()
+    acquired_at = []
+    threads = [threading.Thread(target=lambda: limiter.acquire() and acquired_at.append(time.time()))
+               for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    while limiter.stats()['queue_depth'] < 3:
+        time.sleep(0.005)
+    paused_at = time.time()
+    limiter.on_throttled(pause=0.5)
+    for thread in threads:
+        thread.join(5)
+    assert len(acquired_at) == 3
+    assert min(acquired_at) >= paused_at + 0.5
+    assert limiter.stats()['queue_depth'] == 0
@@ -0,0 +1,138 @@
+import threading
+import time
+
+import pytest
+
+DATE = "2026-10-21"
+MENU = [{"date": DATE, "mealOptions": [{"id": 1}]}]
+STALE = [{"date": DATE, "mealOptions": [{"id": 0}]}]
+
+
+class BlockingFetch:
+    ''' Stands in for APIClient._fetch_and_store; blocks until released, then returns
+        outcome for every date or raises it '''
+    def __init__(self, outcome):
+        self.outcome = outcome
+        self.calls = 0
+        self.started = threading.Event()
+        self.release = threading.Event()
+
+    def __call__(self, dates, deadline=None):
+        self.calls += 1
+        self.started.set()
+        self.release.wait(5)
+        if isinstance(self.outcome, BaseException):
+            raise self.outcome
+        return {date: self.outcome for date in dates}
+
+
+def seed_stale(client):
+    # past the hard TTL: refetched, and only served again if that fails
+    now = time.time()
+    client._raw_cache.set_entry(client._raw_key(DATE), (STALE, now - 1000, "digest"),
+                                now - client.cache_hard_ttl, now + 60)
+
+
+def start_leader_and_follower(client, monkeypatch, fetch):
+    ''' Starts a leader blocked in fetch and a follower waiting for its flight '''
+    monkeypatch.setattr(client, "_fetch_and_store", fetch)
+    followed = threading.Event()
+    join_flight = client._join_flight
+
+    def joining(key):
+        future, is_leader = join_flight(key)
+        if not is_leader:
+            followed.set()
+        return future, is_leader
+    monkeypatch.setattr(client, "_join_flight", joining)
+
+    results = {}
+
+    def call(name):
+        try:
+            results[name] = client.fetch_raw_menus([DATE])[DATE]
+        except Exception as e:
+            results[name] = e
+
+    leader = threading.Thread(target=call, args=("leader",))
+    leader.start()
+    assert fetch.started.wait(5)
+    follower = threading.Thread(target=call, args=("follower",))
+    follower.start()
+    assert followed.wait(5)
+    return leader, follower, results
+
+
+def test_join_flight_has_one_leader(client):
+    future, is_leader = client._join_flight("key")
+    same, follows = client._join_flight("key")
+    assert is_leader and not follows
+    assert same is future
+    client._finish_flight("key", result=[1])
+    assert future.result(0) == [1]
+    # a finished flight is gone; the next caller leads a new one
+    assert client._join_flight("key")[1]
+
+
+def test_finish_flight_hands_errors_to_followers(client):
+    future, _ = client._join_flight("key")
+    client._finish_flight("key", error=ValueError("upstream"))
+    with pytest.raises(ValueError):
+        future.result(0)
+    assert client._inflight == {}
+
+
+def test_followers_share_the_leaders_fetch(client, monkeypatch):
+    fetch = BlockingFetch(MENU)
+    leader, follower, results = start_leader_and_follower(client, monkeypatch, fetch)
+    fetch.release.set()
+    leader.join(5)
+    follower.join(5)
+    assert results == {"leader": MENU, "follower": MENU}
+    assert fetch.calls == 1
+
+
+def test_follower_falls_back_to_stale_when_the_leader_fails(client, monkeypatch):
+    seed_stale(client)
+    # None: the upstream request failed
+    fetch = BlockingFetch(None)
+    leader, follower, results = start_leader_and_follower(client, monkeypatch, fetch)
+    fetch.release.set()
+    leader.join(5)
+    follower.join(5)
+    assert results == {"leader": STALE, "follower": STALE}
+    assert client._inflight == {}
+
+
+def test_follower_falls_back_to_stale_when_the_leader_raises(client, monkeypatch):
+    seed_stale(client)
+    fetch = BlockingFetch(RuntimeError("boom"))
+    leader, follower, results = start_leader_and_follower(client, monkeypatch, fetch)
+    fetch.release.set()
+    leader.join(5)
+    follower.join(5)
+    assert isinstance(results["leader"], RuntimeError)
+    assert results["follower"] == STALE
+    assert client._inflight == {}
+
+
+def test_follower_without_stale_menu_gets_no_menu_when_the_leader_fails(client, monkeypatch):
+    fetch = BlockingFetch(None)
+    leader, follower, results = start_leader_and_follower(client, monkeypatch, fetch)
+    fetch.release.set()
+    leader.join(5)
+    follower.join(5)
+    assert results == {"leader": [], "follower": []}
+
+
+def test_follower_stops_waiting_for_a_slow_leader(client, monkeypatch):
+    seed_stale(client)
+    client.inflight_wait_timeout = 0.1
+    fetch = BlockingFetch(MENU)
+    leader, follower, results = start_leader_and_follower(client, monkeypatch, fetch)
+    follower.join(5)
+    assert results == {"follower": STALE}
+    assert leader.is_alive()
+    fetch.release.set()
+    leader.join(5)
+    assert results["leader"] == MENU